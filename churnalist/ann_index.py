@@ -0,0 +1,139 @@
+#!/usr/bin/python
+"""Approximate nearest-neighbour search for the embedding store
+
+An inverted file (IVF) index groups the unit-length word vectors of an
+embedding store into nlist clusters with spherical k-means. A query only
+compares itself to the words in the nprobe clusters with the closest
+centroids, instead of to the whole vocabulary. More probes give better
+recall and slower queries; recall_report() shows the trade-off.
+
+The index is saved in the store directory:
+ivf_centroids.npy -- unit-length cluster centroids
+ivf_offsets.npy   -- start of every cluster in ivf_ids.npy
+ivf_ids.npy       -- word ids, grouped by cluster
+"""
+import os
+import sys
+import time
+import random
+import logging
+import numpy as np
+from churnalist.embedding_utils import unit
+
+log = logging.getLogger(__name__)
+
+def _assign(vectors, centroids, block_size=65536):
+    """Return the id of the closest centroid for every vector, computed in blocks"""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        assignment[start:start + len(block)] = np.argmax(np.dot(block, centroids.T), axis=1)
+    return assignment
+
+def _kmeans(sample, nlist, iterations, rng):
+    """Spherical k-means: cluster unit vectors by cosine similarity"""
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for iteration in range(0, iterations):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        # restart empty clusters at a random sample vector
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty))]
+        centroids = unit(sums)
+    return centroids
+
+def build_ivf(store_dir, vectors, nlist=None, sample_size=None, iterations=10, seed=0):
+    """Cluster vectors and save an IVF index in store_dir
+
+    Keyword arguments:
+    store_dir -- directory of the embedding store
+    vectors -- the word vectors of the store (only their direction matters)
+    nlist -- number of clusters (default: 4 * sqrt(number of words))
+    sample_size -- number of vectors to run k-means on (default: 64 per cluster)
+    iterations -- number of k-means iterations
+    seed -- random seed for the k-means initialisation
+    """
+    if nlist is None:
+        nlist = max(1, int(4 * np.sqrt(len(vectors))))
+    nlist = min(nlist, len(vectors))
+    if sample_size is None:
+        sample_size = 64 * nlist
+    rng = np.random.RandomState(seed)
+    sample_ids = np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))
+    log.info("Clustering %d vectors into %d clusters...", len(sample_ids), nlist)
+    # normalise the sample, so this also works for quantized stores (see quantize.py)
+    centroids = _kmeans(unit(np.asarray(vectors[sample_ids], dtype=np.float32)), nlist, iterations, rng)
+    log.info("Assigning %d vectors to clusters...", len(vectors))
+    assignment = _assign(vectors, centroids)
+    ids = np.argsort(assignment, kind="stable").astype(np.int32)
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+    np.save(os.path.join(store_dir, "ivf_centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(store_dir, "ivf_offsets.npy"), offsets)
+    np.save(os.path.join(store_dir, "ivf_ids.npy"), ids)
+
+class IVFIndex:
+    def __init__(self, store_dir):
+        """Open the IVF index in store_dir, memory-mapped"""
+        self.centroids = np.load(os.path.join(store_dir, "ivf_centroids.npy"))
+        self.offsets = np.load(os.path.join(store_dir, "ivf_offsets.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(store_dir, "ivf_ids.npy"), mmap_mode="r")
+
+    def probe(self, query, nprobe):
+        """Return the sorted word ids in the nprobe clusters closest to the unit vector query"""
+        nprobe = min(nprobe, len(self.centroids))
+        closest = np.argpartition(-np.dot(self.centroids, query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self.ids[self.offsets[c]:self.offsets[c + 1]] for c in closest]))
+
+def exists(store_dir):
+    return os.path.exists(os.path.join(store_dir, "ivf_centroids.npy"))
+
+def recall_report(store, queries=100, topn=10, nprobes=(1, 2, 4, 8, 16, 32, 64), seed=0):
+    """Compare the IVF index of store with exact search and print recall and latency
+
+    Query words are sampled from the most frequent 100000 words.
+
+    Keyword arguments:
+    store -- an EmbeddingStore with an IVF index
+    queries -- number of query words
+    topn -- number of neighbours to compare
+    nprobes -- values of nprobe to report on
+
+    Returns:
+    a list of dictionaries with nprobe, recall and the median latency in ms
+    """
+    rng = random.Random(seed)
+    words = [store.word(rng.randrange(min(len(store), 100000))) for i in range(0, queries)]
+
+    def run(nprobe):
+        results = []
+        latencies = []
+        for word in words:
+            start = time.perf_counter()
+            results.append(set(w for w, score in store.similar_by_word(word, topn, nprobe=nprobe)))
+            latencies.append((time.perf_counter() - start) * 1000)
+        return results, sorted(latencies)[len(latencies) // 2]
+
+    exact, exact_ms = run(None)
+    report = [{"nprobe": None, "recall": 1.0, "latency_ms": exact_ms}]
+    print("exact search: %.3f ms" % exact_ms)
+    for nprobe in nprobes:
+        approximate, ms = run(nprobe)
+        recall = sum(len(a & e) for a, e in zip(approximate, exact)) / float(sum(len(e) for e in exact))
+        report.append({"nprobe": nprobe, "recall": recall, "latency_ms": ms})
+        print("nprobe %3d: recall@%d %.3f, %.3f ms" % (nprobe, topn, recall, ms))
+    return report
+
+if __name__ == "__main__":
+    # usage: python -m churnalist.ann_index build [store_dir] [nlist]
+    # or:    python -m churnalist.ann_index report [store_dir]
+    from churnalist import embedding_store
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = sys.argv[1:]
+    store_dir = args[1] if len(args) > 1 else embedding_store.EN_STORE
+    if len(args) > 0 and args[0] == "report":
+        recall_report(embedding_store.EmbeddingStore(store_dir))
+    else:
+        build_ivf(store_dir, embedding_store.EmbeddingStore(store_dir).vectors, int(args[2]) if len(args) > 2 else None)
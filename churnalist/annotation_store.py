@@ -0,0 +1,343 @@
+#!/usr/bin/python
+"""Precomputed parse annotations for the headline corpus
+
+Finding the subject and object of a headline needs a spaCy parse. Instead of
+parsing a random headline for every generated headline, we parse the whole
+corpus once with ingest() and store, for every line, the character offsets,
+root tag and number (singular/plural) of its subject and object.
+
+The store is a directory with a manifest.json and one binary file per shard
+of shard_size lines. Each shard is written to a temporary file and renamed
+when it is complete, so an interrupted ingestion can be resumed: shards that
+already exist are skipped. Shards can also be divided over several processes
+or machines with the worker/workers arguments.
+
+Shard layout:
+magic (4 bytes) | number of records (uint32) | length of tag table (uint32) |
+tag table (json list of tag strings) | records (RECORD, one per line)
+"""
+import os
+import sys
+import json
+import mmap
+import array
+import bisect
+import random
+import struct
+import logging
+from churnalist import pipelines
+from churnalist import line_index
+from churnalist.paths import data_path
+from churnalist import topic_substitution as ts
+
+log = logging.getLogger(__name__)
+
+ANNOTATIONS_EN = data_path("headlines.annotations")
+
+MAGIC = b"CHA1"
+HEADER = struct.Struct("<4sII")
+# subj start, subj end, obj start, obj end, subj tag, obj tag, subj number, obj number
+RECORD = struct.Struct("<iiiiBBBB")
+NUMBERS = [None, "singular", "plural"]
+
+class Target:
+    """A subject or object of a headline, read from the annotation store
+
+    Has the attributes of a spaCy Span that substitute() and conjugate() use,
+    so it can be used in their place.
+    """
+    def __init__(self, text, tag, number):
+        self.text = text
+        self.tag_ = tag
+        self.number = number
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return "Target(%r, %r, %r)" % (self.text, self.tag_, self.number)
+
+def _shard_name(shard_no):
+    return "shard-%06d.bin" % shard_no
+
+def _span_record(target, lang, tags):
+    """Return (start, end, tag index, number index) of target, (-1, -1, 0, 0) for None"""
+    if target is None:
+        return -1, -1, 0, 0
+    if hasattr(target, "start_char"): # span
+        start, end = target.start_char, target.end_char
+        tag = target.root.tag_
+    else: # token
+        start, end = target.idx, target.idx + len(target.text)
+        tag = target.tag_
+    if tag not in tags:
+        if len(tags) > 255:
+            raise ValueError("Too many different tags for one shard")
+        tags.append(tag)
+    return start, end, tags.index(tag), NUMBERS.index(ts.get_number(target, lang))
+
+def _write_shard(path, lines, nlp, lang, batch_size):
+    tags = [""]
+    records = []
+    for doc in nlp.pipe(lines, batch_size=batch_size):
+        s_start, s_end, s_tag, s_num = _span_record(ts.find_subj_in_doc(doc), lang, tags)
+        o_start, o_end, o_tag, o_num = _span_record(ts.find_obj_in_doc(doc), lang, tags)
+        records.append(RECORD.pack(s_start, s_end, o_start, o_end, s_tag, o_tag, s_num, o_num))
+    _write_records(path, records, tags)
+
+def _write_records(path, records, tags):
+    tagtable = json.dumps(tags).encode("utf-8")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as outfile:
+        outfile.write(HEADER.pack(MAGIC, len(records), len(tagtable)))
+        outfile.write(tagtable)
+        outfile.write(b"".join(records))
+    os.replace(tmp, path)
+
+def _read_shards(corpus, shard_size):
+    """Yield (shard number, list of lines) for corpus"""
+    lines = []
+    shard_no = 0
+    # split and decode like line_index, so line numbers and offsets agree with it
+    with open(corpus, "r", encoding="utf-8", newline="\n") as infile:
+        for line in infile:
+            lines.append(line.rstrip("\n"))
+            if len(lines) == shard_size:
+                yield shard_no, lines
+                lines = []
+                shard_no += 1
+    if lines:
+        yield shard_no, lines
+
+def _corpus_version(corpus):
+    """Return (size, mtime in ns) of corpus, to notice when it changes after ingestion"""
+    stat = os.stat(corpus)
+    return stat.st_size, stat.st_mtime_ns
+
+def _corpus_path(store_dir, corpus):
+    """Return the path of the corpus of a manifest, which is relative to store_dir (or absolute in old stores)"""
+    return os.path.normpath(os.path.join(store_dir, corpus))
+
+def _write_manifest(store_dir, corpus, lang, shard_size):
+    """Create store_dir with its manifest, or check that an existing store has the same settings
+
+    The corpus is recorded relative to store_dir, so the two can be moved together.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest_path = os.path.join(store_dir, "manifest.json")
+    size, mtime = _corpus_version(corpus)
+    manifest = {"corpus": os.path.relpath(corpus, store_dir), "lang": lang, "shard_size": shard_size, "corpus_size": size, "corpus_mtime": mtime}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as infile:
+            existing = json.load(infile)
+        same_corpus = os.path.abspath(_corpus_path(store_dir, existing.get("corpus", ""))) == os.path.abspath(corpus)
+        if not same_corpus or dict(existing, corpus=manifest["corpus"]) != manifest:
+            raise ValueError("Annotation store %s was made with different settings: %s" % (store_dir, existing))
+    else:
+        # parallel workers may read it at any moment, so it appears complete or not at all
+        tmp = "%s.%d.tmp" % (manifest_path, os.getpid())
+        with open(tmp, "w") as outfile:
+            json.dump(manifest, outfile)
+        os.replace(tmp, manifest_path)
+
+def ingest(corpus, store_dir, lang="en", shard_size=100000, batch_size=1000, worker=0, workers=1):
+    """Parse every line of corpus and write the subject/object annotations to store_dir
+
+    Keyword arguments:
+    corpus -- plaintext file with one headline per line
+    store_dir -- directory for the annotation store, created if it doesn't exist
+    lang -- language "nl" or "en"
+    shard_size -- number of lines per shard
+    batch_size -- batch size for nlp.pipe()
+    worker, workers -- only parse the shards for which shard_no % workers == worker
+    """
+    if shard_size <= 0 or batch_size <= 0:
+        raise ValueError("shard_size and batch_size should be positive")
+    if not 0 <= worker < workers:
+        raise ValueError("worker should be in range(0, workers)")
+    _write_manifest(store_dir, corpus, lang, shard_size)
+    nlp = pipelines.get_pipeline(lang, pipelines.NO_NER)
+    for shard_no, lines in _read_shards(corpus, shard_size):
+        if shard_no % workers != worker:
+            continue
+        path = os.path.join(store_dir, _shard_name(shard_no))
+        if os.path.exists(path):
+            log.info("Skipping shard %d (already done)", shard_no)
+            continue
+        log.info("Parsing shard %d with %d headlines...", shard_no, len(lines))
+        _write_shard(path, lines, nlp, lang, batch_size)
+
+def write_store(store_dir, corpus, targets, lang="en", shard_size=100000):
+    """Write an annotation store for targets that are already known, e.g. of a synthetic corpus
+
+    Keyword arguments:
+    store_dir -- directory for the annotation store, created if it doesn't exist
+    corpus -- plaintext file with one headline per line
+    targets -- one (subject, object) pair per line of corpus, each None or
+               (start, end, tag, number) with character offsets and number "singular" or "plural"
+    lang -- language "nl" or "en"
+    shard_size -- number of lines per shard
+    """
+    if shard_size <= 0:
+        raise ValueError("shard_size should be positive")
+    _write_manifest(store_dir, corpus, lang, shard_size)
+    tags = [""]
+    records = []
+    shard_no = 0
+    for subj, obj in targets:
+        fields = []
+        for target in (subj, obj):
+            if target is None:
+                fields.append((-1, -1, 0, 0))
+                continue
+            start, end, tag, number = target
+            if tag not in tags:
+                tags.append(tag)
+            fields.append((start, end, tags.index(tag), NUMBERS.index(number)))
+        (s_start, s_end, s_tag, s_num), (o_start, o_end, o_tag, o_num) = fields
+        records.append(RECORD.pack(s_start, s_end, o_start, o_end, s_tag, o_tag, s_num, o_num))
+        if len(records) == shard_size:
+            _write_records(os.path.join(store_dir, _shard_name(shard_no)), records, tags)
+            tags = [""]
+            records = []
+            shard_no += 1
+    if records:
+        _write_records(os.path.join(store_dir, _shard_name(shard_no)), records, tags)
+
+class AnnotationStore:
+    def __init__(self, store_dir, corpus=None):
+        """Read-only view on an annotation store made by ingest()
+
+        Shards are memory-mapped, records are only unpacked when they are used.
+        Incomplete stores can be used as well: only the lines of finished
+        shards are available. Raises ValueError if the corpus has changed since
+        the store was made, because the stored offsets would be wrong.
+
+        Keyword arguments:
+        store_dir -- directory of the annotation store
+        corpus -- the headline corpus, if it is not where the manifest says (default: None)
+        """
+        with open(os.path.join(store_dir, "manifest.json"), "r") as infile:
+            manifest = json.load(infile)
+        self.store_dir = store_dir
+        self.corpus = corpus if corpus is not None else _corpus_path(store_dir, manifest["corpus"])
+        self.lang = manifest["lang"]
+        self.shard_size = manifest["shard_size"]
+        if "corpus_size" not in manifest:
+            log.warning("Annotation store %s does not record the version of %s, it can't be checked", store_dir, self.corpus)
+        elif _corpus_version(self.corpus) != (manifest["corpus_size"], manifest["corpus_mtime"]):
+            raise ValueError("%s has changed since annotation store %s was made, ingest it again" % (self.corpus, store_dir))
+        self._shards = [] # (shard_no, mmap, tags, offset of first record, count)
+        self._cumulative = [] # number of records before each shard
+        total = 0
+        for name in sorted(os.listdir(store_dir)):
+            if not (name.startswith("shard-") and name.endswith(".bin")):
+                continue
+            with open(os.path.join(store_dir, name), "rb") as infile:
+                data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count, taglen = HEADER.unpack_from(data, 0)
+            if magic != MAGIC:
+                raise ValueError("%s is not an annotation shard" % name)
+            tags = json.loads(data[HEADER.size:HEADER.size + taglen].decode("utf-8"))
+            self._cumulative.append(total)
+            self._shards.append((int(name[6:12]), data, tags, HEADER.size + taglen, count))
+            total += count
+        self._total = total
+        self._target_ids = {}
+
+    def __len__(self):
+        return self._total
+
+    def _record(self, i):
+        """Return (line number, shard tags, unpacked record) for the i-th stored record"""
+        s = bisect.bisect_right(self._cumulative, i) - 1
+        shard_no, data, tags, offset, count = self._shards[s]
+        local = i - self._cumulative[s]
+        return shard_no * self.shard_size + local, tags, RECORD.unpack_from(data, offset + local * RECORD.size)
+
+    def get(self, i):
+        """Return (headline, object, subject) for the i-th stored record
+
+        object and subject are Target objects, or None if the parser did not find one.
+        """
+        line_no, tags, (s_start, s_end, o_start, o_end, s_tag, o_tag, s_num, o_num) = self._record(i)
+        headline = line_index.get_index(self.corpus).get_line(line_no)
+        obj = Target(headline[o_start:o_end], tags[o_tag], NUMBERS[o_num]) if o_start >= 0 else None
+        subj = Target(headline[s_start:s_end], tags[s_tag], NUMBERS[s_num]) if s_start >= 0 else None
+        return headline, obj, subj
+
+    def headline(self, i):
+        """Return only the headline of the i-th stored record"""
+        s = bisect.bisect_right(self._cumulative, i) - 1
+        return line_index.get_index(self.corpus).get_line(self._shards[s][0] * self.shard_size + i - self._cumulative[s])
+
+    def sample(self, n, rng=random, ids=None):
+        """Return a list of n random (headline, object, subject) tuples
+
+        Keyword arguments:
+        n -- number of tuples
+        rng -- random number generator (default: the random module)
+        ids -- only sample from these record ids (default: all records)
+        """
+        if n <= 0:
+            raise ValueError("N can't be negative")
+        if ids is None:
+            if self._total == 0:
+                raise ValueError("The annotation store is empty")
+            return [self.get(rng.randrange(self._total)) for i in range(0, n)]
+        if len(ids) == 0:
+            raise ValueError("No records to sample from")
+        return [self.get(ids[rng.randrange(len(ids))]) for i in range(0, n)]
+
+    def target_ids(self, subject=False, number=None, max_length=None):
+        """Return an array with the ids of all records that have an object to substitute
+
+        The records are scanned once per combination of arguments, after that
+        the array is reused.
+
+        Keyword arguments:
+        subject -- only records that have a subject as well
+        number -- only records whose object is "singular" or "plural" (default: any)
+        max_length -- only records whose object has at most this many characters (default: any)
+        """
+        key = (subject, number, max_length)
+        ids = self._target_ids.get(key)
+        if ids is None:
+            if number is not None and number not in NUMBERS:
+                raise ValueError("number should be 'singular', 'plural' or None")
+            ids = array.array("I")
+            for start, (shard_no, data, tags, offset, count) in zip(self._cumulative, self._shards):
+                records = RECORD.iter_unpack(memoryview(data)[offset:offset + count * RECORD.size])
+                for local, (s_start, s_end, o_start, o_end, s_tag, o_tag, s_num, o_num) in enumerate(records):
+                    if o_start < 0 or (subject and s_start < 0):
+                        continue
+                    if number is not None and NUMBERS[o_num] != number:
+                        continue
+                    if max_length is not None and o_end - o_start > max_length:
+                        continue
+                    ids.append(start + local)
+            self._target_ids[key] = ids
+        return ids
+
+def open_store(store_dir=ANNOTATIONS_EN):
+    """Return the AnnotationStore in store_dir, or None if nothing (usable) has been ingested yet"""
+    if not os.path.exists(os.path.join(store_dir, "manifest.json")):
+        return None
+    try:
+        store = AnnotationStore(store_dir)
+    except (ValueError, OSError) as e: # e.g. the corpus has changed or is missing
+        log.warning("Not using annotation store: %s", e)
+        return None
+    if len(store) == 0:
+        return None
+    return store
+
+if __name__ == "__main__":
+    # usage: python -m churnalist.annotation_store [corpus] [store_dir] [worker] [workers]
+    args = sys.argv[1:]
+    corpus = args[0] if len(args) > 0 else ts.PLAINTEXT_EN
+    store_dir = args[1] if len(args) > 1 else ANNOTATIONS_EN
+    worker = int(args[2]) if len(args) > 2 else 0
+    workers = int(args[3]) if len(args) > 3 else 1
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    ingest(corpus, store_dir, "en", worker=worker, workers=workers)
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+"""Asyncio interface to headline generation
+
+Parsing and conjugation are CPU-bound and would block the event loop, so the
+work of a HeadlineGenerator runs in a shared, bounded thread pool. All
+requests use the same loaded spaCy pipelines and caches, because the threads
+live in one process. The event loop only waits for results.
+
+    from churnalist import async_generation
+
+    async def ticker(seedwords):
+        generator = await async_generation.AsyncHeadlineGenerator.create(seedwords, timeout=5)
+        async for headline in generator.generate(100):
+            print(headline)
+
+Requests to the same generator are queued behind an asyncio.Lock, so the
+generator is never used by two threads at once. Cancelling the task that
+waits for a headline drops the request if it has not started yet. Running
+work can't be interrupted; the next request of the same generator waits for
+it. Timeouts raise asyncio.TimeoutError.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from churnalist import generation
+
+# number of threads that generate headlines at the same time
+MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return the shared thread pool of this process"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="churnalist")
+        return _executor
+
+def configure(max_workers=MAX_WORKERS):
+    """Replace the shared thread pool by one with max_workers threads"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="churnalist")
+        return _executor
+
+async def run(function, *args, timeout=None, executor=None):
+    """Run a blocking function in the thread pool and return its result, e.g. to analyse an input text"""
+    future = asyncio.wrap_future((executor or get_executor()).submit(function, *args))
+    return await asyncio.wait_for(future, timeout)
+
+class AsyncHeadlineGenerator:
+    def __init__(self, generator, timeout=None, executor=None):
+        """Wrap a HeadlineGenerator for use from asyncio
+
+        Keyword arguments:
+        generator -- a HeadlineGenerator
+        timeout -- maximum number of seconds per headline (default: None, no limit)
+        executor -- thread pool to run in (default: the shared pool, see get_executor())
+        """
+        self.generator = generator
+        self.timeout = timeout
+        self._executor = executor or get_executor()
+        self._running = None # the concurrent future of the last request
+        self._lock = None # asyncio.Lock, made in the event loop of the first request
+
+    @classmethod
+    async def create(cls, *args, timeout=None, executor=None, **kwargs):
+        """Create a HeadlineGenerator(*args, **kwargs) in the thread pool and wrap it
+
+        Creating a generator can take a while, e.g. for the blacklist pre-filter.
+        """
+        generator = await run(functools.partial(generation.HeadlineGenerator, *args, **kwargs), executor=executor)
+        return cls(generator, timeout, executor)
+
+    async def _call(self, function, *args, timeout=None):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # one request at a time: HeadlineGenerator is not thread-safe
+        async with self._lock:
+            if self._running is not None and not self._running.done():
+                # an earlier request was cancelled or timed out while it was running
+                await asyncio.wait([asyncio.wrap_future(self._running)])
+            self._running = self._executor.submit(function, *args)
+            # cancelling the asyncio future also cancels the request if it hasn't started
+            return await asyncio.wait_for(asyncio.wrap_future(self._running), timeout)
+
+    async def next_headline(self, timeout=None):
+        """Return one new headline (timeout: seconds, default: the timeout of this generator)"""
+        return await self._call(self.generator.next_headline, timeout=timeout if timeout is not None else self.timeout)
+
+    async def generate_batch(self, n, timeout=None):
+        """Return a list of exactly n headlines, generated in one go (timeout: seconds for the whole batch)"""
+        return await self._call(self.generator.generate_batch, n, timeout=timeout)
+
+    async def generate(self, n=None, timeout=None):
+        """Yield n headlines (default: never stop), one at a time
+
+        Keyword arguments:
+        n -- number of headlines, or None for an endless stream
+        timeout -- seconds for all n headlines together (default: None, no limit);
+                   every single headline is also limited by the timeout of this generator
+        """
+        if n is not None and n < 0:
+            raise ValueError("n for generate(n) can't be lower than 0")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        count = 0
+        while n is None or count < n:
+            step = self.timeout
+            if deadline is not None:
+                remaining = max(0, deadline - loop.time())
+                step = remaining if step is None else min(step, remaining)
+            yield await self._call(self.generator.next_headline, timeout=step)
+            count += 1
+
+    def __aiter__(self):
+        return self.generate().__aiter__()
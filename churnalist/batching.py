@@ -0,0 +1,193 @@
+#!/usr/bin/python
+"""Micro-batching parse service for concurrent requests
+
+Concurrent requests that each parse a few headlines make many small nlp()
+calls. A ParseService collects the sentences of all requests in one queue.
+A background thread takes what is waiting, up to max_batch sentences or
+max_wait seconds after the first one, and parses it with a single nlp.pipe()
+call. Every caller gets its own docs back through a future.
+
+Give a HeadlineGenerator the service's parse method to use it:
+
+    service = ParseService("en", max_batch=256, max_wait=0.005)
+    generator = generation.HeadlineGenerator(seedwords, parser=service.parse)
+
+Substitution stays in the calling thread; it is cheap because inflections
+are cached. load_test() compares the throughput of concurrent clients with
+and without the service:
+
+    python -m churnalist.batching [clients] [headlines per client]
+"""
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from churnalist import metrics
+from churnalist import pipelines
+
+log = logging.getLogger(__name__)
+
+# seconds that parse() waits for its docs before it gives up
+PARSE_TIMEOUT = 60.0
+
+class ParseService:
+    def __init__(self, lang="en", disable=pipelines.NO_NER, max_batch=256, max_wait=0.005):
+        """Create a parse service, its thread starts with the first request
+
+        Keyword arguments:
+        lang -- language "nl" or "en"
+        disable -- pipeline components to leave out (default: pipelines.NO_NER)
+        max_batch -- maximum number of sentences per nlp.pipe() call
+        max_wait -- maximum number of seconds the first sentence of a batch waits for others
+        """
+        if max_batch <= 0 or max_wait < 0:
+            raise ValueError("max_batch should be positive and max_wait can't be negative")
+        self.lang = lang
+        self.disable = disable
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _start(self):
+        """Start the worker thread, again in a forked process (threads don't survive a fork)
+
+        Call with self._lock held.
+        """
+        if self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name="churnalist-parse", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, sentences):
+        """Queue sentences for parsing and return one Future (with the doc) per sentence"""
+        futures = [Future() for sentence in sentences]
+        with self._lock: # a worker that fails to start drains its queue under this lock
+            requests = self._start()
+            for sentence, future in zip(sentences, futures):
+                requests.put((sentence, future))
+        return futures
+
+    def parse(self, sentences, timeout=PARSE_TIMEOUT):
+        """Parse sentences together with the sentences of other requests and return the docs
+
+        Raises concurrent.futures.TimeoutError if the docs aren't ready after timeout seconds.
+        """
+        futures = self.submit(sentences)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            return [future.result(None if deadline is None else max(0, deadline - time.monotonic())) for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _next_batch(self, requests):
+        """Wait for a request, then collect more until the batch is full or max_wait has passed"""
+        first = requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None: # close() was called, finish this batch first
+                requests.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _fail_queue(self, requests, error):
+        """Stop using requests and fail everything in it, the next submit() starts a new thread"""
+        with self._lock:
+            if self._queue is requests:
+                self._pid = None
+            while True:
+                try:
+                    item = requests.get_nowait()
+                except queue.Empty:
+                    return
+                if item is not None and item[1].set_running_or_notify_cancel():
+                    item[1].set_exception(error)
+
+    def _run(self, requests):
+        try:
+            nlp = pipelines.get_pipeline(self.lang, self.disable)
+        except Exception as e:
+            log.exception("Loading the %s pipeline for the parse service failed", self.lang)
+            self._fail_queue(requests, e)
+            return
+        while True:
+            batch = self._next_batch(requests)
+            if batch is None:
+                return
+            # leave out the requests that were cancelled while they waited
+            batch = [(sentence, future) for sentence, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            metrics.count("service_batches")
+            metrics.count("service_sentences", len(batch))
+            try:
+                with metrics.stage("service_parse"):
+                    docs = list(nlp.pipe([sentence for sentence, future in batch], batch_size=len(batch)))
+            except Exception as e:
+                log.exception("Parsing a batch of %d sentences failed", len(batch))
+                for sentence, future in batch:
+                    future.set_exception(e)
+                continue
+            for doc, (sentence, future) in zip(docs, batch):
+                future.set_result(doc)
+
+    def close(self):
+        """Stop the worker thread after the waiting requests are parsed"""
+        with self._lock:
+            running = self._pid == os.getpid()
+            requests, thread = self._queue, self._thread
+            self._pid = None
+        if running: # join outside the lock, a failing worker needs it
+            requests.put(None)
+            thread.join()
+
+def load_test(clients=50, headlines=10, max_batch=256, max_wait=0.005, seedwords=("dragon", "wizards", "castle")):
+    """Let concurrent clients generate headlines with and without a ParseService
+
+    Every client has its own HeadlineGenerator that parses one headline at a
+    time, like a demo request. Returns the headlines per second for both modes.
+    """
+    from churnalist import generation
+    pipelines.preload(["en"], pipelines.NO_NER)
+
+    def run(parser):
+        def client(i):
+            generator = generation.HeadlineGenerator(list(seedwords), seed=i, batch_size=1, parser=parser)
+            return len(list(generator.generate(headlines)))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            total = sum(pool.map(client, range(0, clients)))
+        return total / (time.perf_counter() - start)
+
+    per_request = run(None)
+    service = ParseService("en", max_batch=max_batch, max_wait=max_wait)
+    try:
+        batched = run(service.parse)
+    finally:
+        service.close()
+    print("%d clients x %d headlines" % (clients, headlines))
+    print("per request: %.1f headlines/s" % per_request)
+    print("micro-batched: %.1f headlines/s (%.2fx)" % (batched, batched / per_request))
+    return {"clients": clients, "headlines": headlines, "per_request": per_request, "batched": batched}
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    load_test(int(args[0]) if len(args) > 0 else 50, int(args[1]) if len(args) > 1 else 10)
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+"""Offline benchmarks for extraction, expansion, substitution and generation
+
+Everything runs on synthetic data, so no ConceptNet access, headline corpus
+or fastText model is needed:
+- synthetic headline corpora of 10^3 up to 10^7 lines ("<Subject> <verb>
+  <adjective> <object>"), with an annotation store written from the known
+  targets, so generation can be measured without parsing the whole corpus
+- a small synthetic embedding store for LazyFastText("en_mmap")
+
+Benchmarks that need a library that is not installed (e.g. the spaCy model
+or pattern3) are reported as skipped. The results are written as JSON, with
+the commit they were measured on, so runs can be compared:
+
+    python -m churnalist.benchmark [output.json] [largest corpus size]
+    python -m churnalist.benchmark compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from churnalist import line_index
+from churnalist import blacklist as bl
+from churnalist import annotation_store
+from churnalist import embedding_store
+from churnalist import generation
+
+SIZES = [10**3, 10**4, 10**5]
+# number of headlines for the benchmarks that parse every headline
+SAMPLE = 1000
+SEEDWORDS = ["dragon", "wizards", "castle", "potion", "knights"]
+
+# (text, tag, number)
+SUBJECTS = [("Government", "NN", "singular"), ("Scientists", "NNS", "plural"), ("Police", "NN", "singular"),
+            ("Mayor", "NN", "singular"), ("Students", "NNS", "plural"), ("Company", "NN", "singular"),
+            ("Fans", "NNS", "plural"), ("Minister", "NN", "singular"), ("Doctors", "NNS", "plural")]
+VERBS = ["bans", "praises", "investigates", "buys", "rejects", "discovers", "sells", "defends", "blames", "welcomes"]
+ADJECTIVES = ["new", "controversial", "local", "secret", "old", "giant", "digital", "free"]
+OBJECTS = ["plan", "vaccine", "bridge", "law", "robot", "festival", "app", "tax", "school", "game", "war"]
+
+def synthetic_headlines(n, seed=0):
+    """Yield n (headline, subject, object) tuples, targets as (start, end, tag, number)"""
+    rng = random.Random(seed)
+    for i in range(0, n):
+        subj, subj_tag, subj_number = rng.choice(SUBJECTS)
+        obj = rng.choice(OBJECTS)
+        obj_tag, obj_number = "NN", "singular"
+        if rng.random() < 0.5:
+            obj, obj_tag, obj_number = obj + ("es" if obj.endswith("x") else "s"), "NNS", "plural"
+        prefix = "%s %s %s " % (subj, rng.choice(VERBS), rng.choice(ADJECTIVES))
+        yield prefix + obj, (0, len(subj), subj_tag, subj_number), (len(prefix), len(prefix) + len(obj), obj_tag, obj_number)
+
+def write_corpus(filename, n, seed=0):
+    with open(filename, "w") as outfile:
+        for headline, subj, obj in synthetic_headlines(n, seed):
+            outfile.write(headline + "\n")
+
+def write_embedding(store_dir, count=20000, dim=100, seed=0):
+    """Write a synthetic embedding store with count random words, half of them nouns"""
+    rng = np.random.RandomState(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(chr(ord("a") + c) for c in rng.randint(0, 26, rng.randint(4, 11))))
+    words = sorted(words)
+    embedding_store.write_store(store_dir, words, rng.randn(count, dim), ngrams=rng.randn(2000, dim), noun_mask=rng.rand(count) < 0.5)
+    return words
+
+def _measure(results, name, size, items, function):
+    """Time function() and add the result, or the reason it was skipped, to results"""
+    try:
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+    except (ImportError, OSError, LookupError) as e: # missing library, model or nltk data
+        _skip(results, name, size, e)
+        return
+    print("%-28s %10d %10.3f s %12.1f /s" % (name, size, seconds, items / seconds))
+    results.append({"benchmark": name, "size": size, "items": items, "seconds": seconds, "per_second": items / seconds})
+
+def _skip(results, name, size, reason):
+    print("%-28s %10d  skipped: %s" % (name, size, reason))
+    results.append({"benchmark": name, "size": size, "skipped": str(reason)})
+
+def _missing(module):
+    """Return the ImportError of module, or None if it can be imported"""
+    try:
+        __import__(module)
+    except ImportError as e:
+        return e
+    return None
+
+def bench_corpus(results, workdir, size):
+    """Corpus-sized work: writing, indexing, sampling, blacklist pre-filter, target pools and generation"""
+    corpus = os.path.join(workdir, "headlines-%d.txt" % size)
+    store_dir = os.path.join(workdir, "headlines-%d.annotations" % size)
+    _measure(results, "write_corpus", size, size, lambda: write_corpus(corpus, size))
+    index = []
+    _measure(results, "line_index", size, size, lambda: index.append(line_index.LineIndex(corpus)))
+    rng = random.Random(0)
+    _measure(results, "sample_lines", size, 10000, lambda: index[0].sample(10000, rng))
+    blacklist = bl.Blacklist(generation.BLACKLIST)
+    _measure(results, "blacklist_prefilter", size, size, lambda: bl.prefilter(corpus, len(index[0]), index[0].get_line, blacklist))
+    _measure(results, "write_annotation_store", size, size, lambda: annotation_store.write_store(store_dir, corpus, ((s, o) for h, s, o in synthetic_headlines(size))))
+    store = annotation_store.AnnotationStore(store_dir)
+    _measure(results, "target_ids", size, size, lambda: store.target_ids(True))
+    # conjugation catches the ImportError for every headline, which would time the failure path instead
+    missing = _missing("pattern3.en")
+    if missing is not None:
+        _skip(results, "generator_setup", size, missing)
+        _skip(results, "generate_batch", size, missing)
+        return
+    generator = []
+    _measure(results, "generator_setup", size, 1, lambda: generator.append(generation.HeadlineGenerator(SEEDWORDS, store=store, seed=0, prefilter=True)))
+    if generator:
+        _measure(results, "generate_batch", size, 1000, lambda: generator[0].generate_batch(1000))
+
+def bench_parsing(results, sentences):
+    """Per-headline work that needs spaCy: keyword extraction and target finding"""
+    from churnalist import keyword_extraction as ke
+    from churnalist import topic_substitution as ts
+    n = len(sentences)
+    _measure(results, "get_noun_chunk_list", n, n, lambda: ke.get_noun_chunk_list(sentences, "en"))
+    # extraction throughput with worker processes, on enough sentences for several batches
+    many = sentences * 5
+    for n_process in [1, 2, 4]:
+        _measure(results, "get_noun_chunk_list_%dproc" % n_process, len(many), len(many),
+                 lambda: ke.get_noun_chunk_list(many, "en", batch_size=1000, n_process=n_process))
+    _measure(results, "find_obj", n, n, lambda: [ts.find_obj(s, "en") for s in sentences])
+    _measure(results, "find_subj", n, n, lambda: [ts.find_subj(s, "en") for s in sentences])
+    def substitute_all():
+        for s in sentences:
+            obj = ts.find_obj(s, "en")
+            if obj is not None:
+                ts.substitute(s, "dragons", "en", obj)
+    _measure(results, "find_obj_and_substitute", n, n, substitute_all)
+
+def bench_expansion(results, workdir, queries=100):
+    """Related words from a synthetic embedding store, single and batched"""
+    from churnalist import expand_seedwords as kb
+    store_dir = os.path.join(workdir, "embedding.store")
+    words = write_embedding(store_dir)
+    ftw = kb.LazyFastText("en_mmap", store_dir=store_dir)
+    ftw.get_related_words(words[0]) # open the store before timing
+    sample = random.Random(0).sample(words, queries)
+    _measure(results, "get_related_words", len(words), queries, lambda: [ftw.get_related_words(w) for w in sample])
+    _measure(results, "get_related_words_batch", len(words), queries, lambda: ftw.get_related_words_batch(sample))
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes=SIZES, output="benchmark.json"):
+    """Run all benchmarks on synthetic data and write the results to output"""
+    results = []
+    workdir = tempfile.mkdtemp(prefix="churnalist-benchmark-")
+    try:
+        for size in sizes:
+            bench_corpus(results, workdir, size)
+        bench_parsing(results, [h for h, s, o in synthetic_headlines(SAMPLE, seed=1)])
+        bench_expansion(results, workdir)
+    finally:
+        shutil.rmtree(workdir)
+    report = {"commit": _commit(), "time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+              "machine": platform.platform(), "results": results}
+    with open(output, "w") as outfile:
+        json.dump(report, outfile, indent=1)
+    print("Results written to", output)
+    return report
+
+def compare(old_file, new_file):
+    """Print the speed of every benchmark in new_file relative to old_file"""
+    with open(old_file, "r") as infile:
+        old = json.load(infile)
+    with open(new_file, "r") as infile:
+        new = json.load(infile)
+    speeds = {(r["benchmark"], r["size"]): r["per_second"] for r in old["results"] if "per_second" in r}
+    print("%s -> %s" % (old["commit"], new["commit"]))
+    for r in new["results"]:
+        key = (r["benchmark"], r["size"])
+        if "per_second" in r and key in speeds:
+            print("%-28s %10d %8.2fx" % (key[0], key[1], r["per_second"] / speeds[key]))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) > 0 and args[0] == "compare":
+        compare(args[1], args[2])
+    else:
+        output = args[0] if len(args) > 0 else "benchmark.json"
+        largest = int(float(args[1])) if len(args) > 1 else SIZES[-1]
+        run([10**e for e in range(3, 8) if 10**e <= largest], output)
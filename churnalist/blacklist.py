@@ -0,0 +1,94 @@
+#!/usr/bin/python
+"""Blacklist matching for generated headlines
+
+A Blacklist compiles all banned words into one regular expression, shaped
+like a trie (words with a common prefix share a branch), so checking a
+headline is a single regex search no matter how many words are banned.
+By default a banned word matches anywhere in the text, like the old
+`badword in headline.lower()` check; with whole_words=True it only matches
+whole words ("war" no longer matches "award").
+
+prefilter() scans a headline source once and returns the ids of the
+headlines without banned words, so generation never picks the others.
+"""
+import re
+import array
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+class Blacklist:
+    def __init__(self, words, whole_words=False):
+        """Compile a list of banned words
+
+        Keyword arguments:
+        words -- banned words (case insensitive)
+        whole_words -- only match whole words instead of any substring (default: False)
+        """
+        self.words = sorted(set(w.strip().lower() for w in words if w.strip() != ""))
+        self.whole_words = whole_words
+        if self.words:
+            pattern = _trie_pattern(self.words)
+            if whole_words:
+                pattern = r"\b" + pattern + r"\b"
+            self._regex = re.compile(pattern)
+        else:
+            self._regex = None
+
+    def __len__(self):
+        return len(self.words)
+
+    def matches(self, text):
+        """Return True if text contains a banned word"""
+        return self._regex is not None and self._regex.search(text.lower()) is not None
+
+    def find(self, text):
+        """Return the banned words found in text"""
+        if self._regex is None:
+            return []
+        return [m.group(0) for m in self._regex.finditer(text.lower())]
+
+def _trie_pattern(words):
+    """Return a regex that matches any of words, with common prefixes merged"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {} # end of a word
+    return _node_pattern(trie)
+
+def _node_pattern(node):
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char != ""]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node: # a word ends here, longer words are optional
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+_prefilter_cache = {}
+_prefilter_lock = threading.Lock()
+
+def prefilter(key, count, get_text, blacklist):
+    """Return an array with the ids of all texts that don't contain a banned word
+
+    Results are cached per process, so a corpus is only scanned once per blacklist.
+
+    Keyword arguments:
+    key -- name of the text source for the cache, e.g. the corpus filename
+    count -- number of texts in the source
+    get_text -- function that returns the text with id i
+    blacklist -- a Blacklist
+    """
+    cache_key = (key, tuple(blacklist.words), blacklist.whole_words)
+    with _prefilter_lock:
+        ids = _prefilter_cache.get(cache_key)
+    if ids is None:
+        # scan without the lock, so other keys don't wait for this corpus
+        log.info("Removing blacklisted headlines from %s", key)
+        ids = array.array("I", (i for i in range(0, count) if not blacklist.matches(get_text(i))))
+        with _prefilter_lock: # another thread may have finished the same scan first
+            ids = _prefilter_cache.setdefault(cache_key, ids)
+    return ids
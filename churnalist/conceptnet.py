@@ -0,0 +1,125 @@
+#!/usr/bin/python
+"""Client for the ConceptNet /related API
+
+The client reuses its HTTP connections, looks up many words concurrently with
+a bounded thread pool and gives up on slow requests after a timeout. Answers
+are kept in an SQLite cache on disk, so the same word is never requested
+twice within the time-to-live of the cache. Failed requests are not cached.
+
+For tests, point the client at a local stand-in server with configure(base_url=...).
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from churnalist import metrics
+from churnalist.paths import data_path
+
+log = logging.getLogger(__name__)
+
+CONCEPTNET_API = "http://api.conceptnet.io"
+CACHE_FILE = data_path("conceptnet_cache.sqlite")
+
+class ConceptNetClient:
+    def __init__(self, base_url=CONCEPTNET_API, cache_file=CACHE_FILE, ttl=30*24*3600, timeout=5, max_workers=8):
+        """Create a pooled, caching ConceptNet client
+
+        Keyword arguments:
+        base_url -- address of the ConceptNet API (or a local stand-in)
+        cache_file -- SQLite file for the cache, or None for no cache on disk
+        ttl -- number of seconds a cached answer stays valid (default: 30 days)
+        timeout -- number of seconds to wait for the API
+        max_workers -- maximum number of concurrent requests
+        """
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        import requests.adapters # not at the top, so importing this module doesn't load requests
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(cache_file if cache_file is not None else ":memory:", check_same_thread=False)
+        except sqlite3.OperationalError as e: # e.g. the data folder is missing or read-only, keep the cache in memory
+            log.warning("Could not open ConceptNet cache %s: %s", cache_file, e)
+            self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        with self._lock:
+            self._db.execute("CREATE TABLE IF NOT EXISTS related (lang TEXT, word TEXT, fetched REAL, result TEXT, PRIMARY KEY (lang, word))")
+            self._db.execute("DELETE FROM related WHERE fetched < ?", (time.time() - ttl,))
+            self._db.commit()
+
+    def _cached(self, word, lang):
+        with self._lock:
+            row = self._db.execute("SELECT fetched, result FROM related WHERE lang = ? AND word = ?", (lang, word)).fetchone()
+        if row is None or row[0] < time.time() - self.ttl:
+            return None
+        return json.loads(row[1])
+
+    def _store(self, word, lang, result):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO related VALUES (?, ?, ?, ?)", (lang, word, time.time(), json.dumps(result)))
+            self._db.commit()
+
+    def related(self, word, lang):
+        """Return the API result for the related words of word, or None if the request failed
+
+        Keyword arguments:
+        word -- word to look up
+        lang -- language "nl" or "en"
+        """
+        result = self._cached(word, lang)
+        if result is not None:
+            metrics.count("conceptnet_cache_hits")
+            return result
+        import requests
+        metrics.count("conceptnet_requests")
+        url = self.base_url + "/related/c/" + lang + "/" + requests.utils.quote(word) + "?filter=/c/" + lang
+        try:
+            response = self._session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        except (requests.RequestException, ValueError) as e:
+            log.warning("ConceptNet request for %s failed: %s %s", word, type(e).__name__, e)
+            metrics.count("conceptnet_failures")
+            return None
+        self._store(word, lang, result)
+        return result
+
+    def related_many(self, words, lang):
+        """Look up many words concurrently and return {word: API result or None}"""
+        words = list(dict.fromkeys(words)) # unique, in order
+        if not words:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(words))) as pool:
+            results = pool.map(lambda word: self.related(word, lang), words)
+            return dict(zip(words, results))
+
+    def close(self):
+        self._session.close()
+        with self._lock:
+            self._db.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the shared ConceptNetClient of this process"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ConceptNetClient()
+        return _client
+
+def configure(**kwargs):
+    """Replace the shared client by one with other settings, see ConceptNetClient"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = ConceptNetClient(**kwargs)
+        return _client
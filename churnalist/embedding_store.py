@@ -0,0 +1,352 @@
+#!/usr/bin/python
+"""Memory-mapped word embeddings for the fastText knowledge base
+
+Loading wiki.en with gensim and fastText takes tens of seconds and puts the
+whole model in the private memory of every process. convert() turns a
+fastText .bin model into a directory of plain numpy arrays once. An
+EmbeddingStore opens these files read-only with mmap, which is instantaneous,
+and processes on the same host share one copy of the model in the page cache.
+
+Store layout:
+config.json      -- dimension, number of words and the fastText subword settings
+vectors.npy      -- unit-length word vectors, one row per word, most frequent first
+ngrams.npy       -- fastText subword (bucket) vectors, for out-of-vocabulary words
+words.bin        -- utf-8 words separated by newlines
+word_offsets.npy -- byte offset of every word in words.bin
+sorted_ids.npy   -- word ids in byte order of the words, for lookups
+noun_mask.npy    -- True for every alphabetic word that nltk tags as NN or NNS
+ivf_*.npy        -- optional approximate nearest-neighbour index, see ann_index.py
+vector_scales.npy -- scale factor per word, only for int8 stores, see quantize.py
+"""
+import os
+import re
+import sys
+import json
+import logging
+import numpy as np
+from churnalist import ann_index
+from churnalist.embedding_utils import unit, import_fasttext
+from churnalist.paths import data_path
+
+log = logging.getLogger(__name__)
+
+EN_STORE = data_path("fasttext", "wiki.en.store")
+EN_BIN = data_path("fasttext", "wiki.en.bin")
+
+def _ft_hash(ngram):
+    """fastText's hash for a subword: FNV-1a over the bytes, read as signed chars"""
+    h = 2166136261
+    for b in ngram:
+        if b >= 128:
+            b |= 0xFFFFFF00
+        h = ((h ^ b) * 16777619) & 0xFFFFFFFF
+    return h
+
+def subword_ids(word, minn, maxn, bucket):
+    """Return the bucket ids of the character n-grams of word, like fastText's computeSubwords"""
+    word = ("<" + word + ">").encode("utf-8")
+    ids = []
+    for i in range(len(word)):
+        if word[i] & 0xC0 == 0x80: # continuation byte of a utf-8 character
+            continue
+        j = i
+        n = 1
+        while j < len(word) and n <= maxn:
+            j += 1
+            while j < len(word) and word[j] & 0xC0 == 0x80:
+                j += 1
+            if n >= minn and not (n == 1 and (i == 0 or j == len(word))):
+                ids.append(_ft_hash(word[i:j]) % bucket)
+            n += 1
+    return ids
+
+def convert(fasttext_bin, store_dir):
+    """Convert a fastText .bin model to an embedding store in store_dir
+
+    Keyword arguments:
+    fasttext_bin -- fastText model, e.g. EN_BIN
+    store_dir -- output directory, created if it doesn't exist
+    """
+    fasttext = import_fasttext()
+    log.info("Loading fastText model in fastText...")
+    model = fasttext.load_model(fasttext_bin)
+    args = model.f.getArgs()
+    words = model.get_words()
+    dim = model.get_dimension()
+    os.makedirs(store_dir, exist_ok=True)
+
+    log.info("Writing %d word vectors...", len(words))
+    vectors = np.lib.format.open_memmap(os.path.join(store_dir, "vectors.npy"), mode="w+", dtype=np.float32, shape=(len(words), dim))
+    for i, word in enumerate(words):
+        vectors[i] = model.get_word_vector(word)
+    vectors[:] = unit(vectors)
+    vectors.flush()
+    del vectors
+
+    log.info("Writing subword vectors...")
+    np.save(os.path.join(store_dir, "ngrams.npy"), model.get_input_matrix()[len(words):])
+
+    _write_vocabulary(store_dir, words)
+    _write_config(store_dir, dim, len(words), args.minn, args.maxn, args.bucket)
+    build_noun_mask(store_dir)
+
+def _write_vocabulary(store_dir, words):
+    log.info("Writing vocabulary...")
+    encoded = [w.encode("utf-8") for w in words]
+    with open(os.path.join(store_dir, "words.bin"), "wb") as outfile:
+        outfile.write(b"\n".join(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(w) + 1 for w in encoded])
+    np.save(os.path.join(store_dir, "word_offsets.npy"), offsets)
+    np.save(os.path.join(store_dir, "sorted_ids.npy"), np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int32))
+
+def _write_config(store_dir, dim, count, minn, maxn, bucket):
+    with open(os.path.join(store_dir, "config.json"), "w") as outfile:
+        json.dump({"dim": dim, "count": count, "minn": minn, "maxn": maxn, "bucket": bucket}, outfile)
+
+def build_noun_mask(store_dir):
+    """Tag every word of the store once and save which words are alphabetic nouns
+
+    This is the filter that LazyFastText.get_related_words() used to apply to
+    every candidate: no non-alpha characters and an nltk tag of NN or NNS.
+    """
+    import nltk
+    log.info("Tagging vocabulary...")
+    store = EmbeddingStore(store_dir)
+    tagger = nltk.tag.PerceptronTagger()
+    mask = np.zeros(len(store), dtype=bool)
+    for i in range(len(store)):
+        word = store.word(i)
+        if re.fullmatch("[A-Za-z]+", word):
+            mask[i] = tagger.tag(nltk.word_tokenize(word))[0][1] in ["NN", "NNS"]
+    np.save(os.path.join(store_dir, "noun_mask.npy"), mask)
+
+def write_store(store_dir, words, vectors, ngrams=None, minn=3, maxn=6, noun_mask=None):
+    """Write an embedding store for a model that is already in memory, e.g. a small test model
+
+    Keyword arguments:
+    store_dir -- output directory, created if it doesn't exist
+    words -- list of words, most frequent first
+    vectors -- numpy array with one row per word
+    ngrams -- numpy array with fastText subword vectors (optional, needed for unknown words)
+    minn, maxn -- minimum and maximum subword length, as in fastText
+    noun_mask -- boolean array, True for the nouns (optional, see build_noun_mask())
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    np.save(os.path.join(store_dir, "vectors.npy"), unit(np.asarray(vectors, dtype=np.float32)))
+    bucket = 0
+    if ngrams is not None:
+        np.save(os.path.join(store_dir, "ngrams.npy"), np.asarray(ngrams, dtype=np.float32))
+        bucket = len(ngrams)
+    _write_vocabulary(store_dir, words)
+    _write_config(store_dir, np.shape(vectors)[1], len(words), minn, maxn, bucket)
+    if noun_mask is not None:
+        np.save(os.path.join(store_dir, "noun_mask.npy"), np.asarray(noun_mask, dtype=bool))
+
+class EmbeddingStore:
+    def __init__(self, store_dir):
+        """Open an embedding store made by convert(), read-only and memory-mapped
+
+        Implements the parts of gensim's KeyedVectors and fastText's model
+        that LazyFastText uses: similar_by_word() and get_word_vector().
+
+        Keyword arguments:
+        store_dir -- directory of the embedding store
+        """
+        with open(os.path.join(store_dir, "config.json"), "r") as infile:
+            self.config = json.load(infile)
+        self.store_dir = store_dir
+        self.vectors = np.load(os.path.join(store_dir, "vectors.npy"), mmap_mode="r")
+        # int8 stores keep one scale factor per word, see quantize.py
+        scales_path = os.path.join(store_dir, "vector_scales.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        ngrams_path = os.path.join(store_dir, "ngrams.npy")
+        self.ngrams = np.load(ngrams_path, mmap_mode="r") if os.path.exists(ngrams_path) else None
+        self._offsets = np.load(os.path.join(store_dir, "word_offsets.npy"), mmap_mode="r")
+        self._sorted_ids = np.load(os.path.join(store_dir, "sorted_ids.npy"), mmap_mode="r")
+        self._words = np.memmap(os.path.join(store_dir, "words.bin"), dtype=np.uint8, mode="r")
+        mask_path = os.path.join(store_dir, "noun_mask.npy")
+        self.noun_mask = np.load(mask_path, mmap_mode="r") if os.path.exists(mask_path) else None
+        self.ivf = ann_index.IVFIndex(store_dir) if ann_index.exists(store_dir) else None
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def rows(self, start, end):
+        """Return the vectors of word ids start to end as a float32 array"""
+        block = np.asarray(self.vectors[start:end], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:end, None]
+        return block
+
+    def rows_at(self, ids):
+        """Return the vectors of the word ids in ids as a float32 array"""
+        block = np.asarray(self.vectors[ids], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[ids, None]
+        return block
+
+    def vector(self, i):
+        """Return the unit vector of word id i"""
+        return self.rows(i, i + 1)[0]
+
+    def word(self, i):
+        """Return the word with id i"""
+        return self._word_bytes(i).decode("utf-8")
+
+    def _word_bytes(self, i):
+        return bytes(self._words[self._offsets[i]:self._offsets[i + 1] - 1])
+
+    def word_id(self, word):
+        """Return the id of word, or None if it is not in the vocabulary (binary search)"""
+        key = word.encode("utf-8")
+        lo, hi = 0, len(self._sorted_ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word_bytes(self._sorted_ids[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._sorted_ids) and self._word_bytes(self._sorted_ids[lo]) == key:
+            return int(self._sorted_ids[lo])
+        return None
+
+    def __contains__(self, word):
+        return self.word_id(word) is not None
+
+    def get_word_vector(self, word):
+        """Return the vector of word, computed from its subwords if it is out of vocabulary"""
+        i = self.word_id(word)
+        if i is not None:
+            return self.vector(i)
+        if self.ngrams is None or self.config["bucket"] == 0:
+            raise KeyError("word '%s' not in vocabulary" % word)
+        ids = subword_ids(word, self.config["minn"], self.config["maxn"], self.config["bucket"])
+        if not ids:
+            return np.zeros(self.config["dim"], dtype=np.float32)
+        return np.asarray(self.ngrams[ids], dtype=np.float32).mean(axis=0)
+
+    def _scores(self, query, nprobe=None, block_size=65536):
+        """Return (word ids, cosine similarities) of the words to compare with query
+
+        With nprobe, only the words in the nprobe closest clusters of the IVF index
+        are scored. Without nprobe (or without an index), all words are scored and
+        the word ids are simply range(len(self)).
+        """
+        query = unit(np.asarray(query, dtype=np.float32))
+        if nprobe is None or self.ivf is None:
+            scores = [np.dot(self.rows(start, start + block_size), query) for start in range(0, len(self), block_size)]
+            return np.arange(len(self)), np.concatenate(scores)
+        ids = self.ivf.probe(query, nprobe)
+        return ids, np.dot(self.rows_at(ids), query)
+
+    def similar_by_vector(self, vector, topn=10, exclude=(), nprobe=None):
+        """Return the topn (word, cosine similarity) pairs closest to vector
+
+        nprobe -- search the nprobe closest clusters of the IVF index instead of all words
+        """
+        ids, scores = self._scores(vector, nprobe)
+        scores[np.isin(ids, exclude)] = -np.inf
+        topn = min(topn, len(scores))
+        if topn == 0:
+            return []
+        best = np.argpartition(-scores, topn - 1)[:topn]
+        best = best[np.argsort(-scores[best])]
+        return [(self.word(ids[b]), float(scores[b])) for b in best]
+
+    def similar_by_word(self, word, topn=10, nprobe=None):
+        """Return the topn (word, cosine similarity) pairs closest to word, like gensim
+
+        word can also be a vector. Raises KeyError if word is not in the vocabulary.
+        """
+        if not isinstance(word, str):
+            return self.similar_by_vector(word, topn, nprobe=nprobe)
+        i = self.word_id(word)
+        if i is None:
+            raise KeyError("word '%s' not in vocabulary" % word)
+        return self.similar_by_vector(self.vector(i), topn, exclude=[i], nprobe=nprobe)
+
+    def related_nouns(self, word, candidates=1000, results=10, threshold=0.6, nprobe=None):
+        """Return the related nouns of word, with the filter of LazyFastText.get_related_words()
+
+        Instead of tagging the candidates, we look them up in the noun mask, and
+        instead of fetching all candidates we only sort the ones that pass the filter.
+
+        Keyword arguments:
+        word -- target word for which we want similar words
+        candidates -- only consider the candidates most similar words
+        results -- number of words to return
+        threshold -- similarity of the returned words is lower than threshold
+        nprobe -- search the nprobe closest clusters of the IVF index instead of all words
+        """
+        if self.noun_mask is None:
+            raise ValueError("This embedding store has no noun mask, see build_noun_mask()")
+        i = self.word_id(word)
+        query = self.vector(i) if i is not None else self.get_word_vector(word)
+        ids, scores = self._scores(query, nprobe)
+        if i is not None: # like gensim, don't return the word itself
+            scores[ids == i] = -np.inf
+        return self._top_nouns(ids, scores, candidates, results, threshold)
+
+    def related_nouns_batch(self, words, candidates=1000, results=10, threshold=0.6, block_size=65536):
+        """Return {word: related nouns} for many words in one pass over the vocabulary
+
+        The query vectors (from subwords for unknown words) are stacked into one
+        matrix and compared with block_size words of the vocabulary at a time.
+        For every query we keep the candidates best words so far, so the result is
+        the same as calling related_nouns() for every word with exact search.
+
+        Keyword arguments:
+        words -- target words for which we want similar words
+        candidates, results, threshold -- as in related_nouns()
+        block_size -- number of vocabulary words per matrix multiplication
+        """
+        if self.noun_mask is None:
+            raise ValueError("This embedding store has no noun mask, see build_noun_mask()")
+        words = list(dict.fromkeys(words)) # unique, in order
+        if not words:
+            return {}
+        own_ids = [self.word_id(w) for w in words]
+        queries = unit(np.array([self.vector(i) if i is not None else self.get_word_vector(w) for w, i in zip(words, own_ids)], dtype=np.float32))
+        candidates = min(candidates, len(self))
+        # best candidates per query so far, one row per query
+        best_ids = np.zeros((len(words), 0), dtype=np.int64)
+        best_scores = np.zeros((len(words), 0), dtype=np.float32)
+        for start in range(0, len(self), block_size):
+            block = self.rows(start, start + block_size)
+            scores = np.dot(queries, block.T)
+            for q, i in enumerate(own_ids): # like gensim, don't return the word itself
+                if i is not None and start <= i < start + len(block):
+                    scores[q, i - start] = -np.inf
+            ids = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            ids = np.concatenate([best_ids, ids], axis=1)
+            if scores.shape[1] > candidates:
+                keep = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                ids = np.take_along_axis(ids, keep, axis=1)
+            best_scores, best_ids = scores, ids
+        related = {}
+        for q, word in enumerate(words):
+            related[word] = self._top_nouns(best_ids[q], best_scores[q], candidates, results, threshold)
+        return related
+
+    def _top_nouns(self, ids, scores, candidates, results, threshold):
+        """Return the results best-scoring nouns below threshold among the candidates best words"""
+        candidates = min(candidates, len(scores))
+        if candidates == 0 or results == 0:
+            return []
+        cutoff = np.partition(scores, len(scores) - candidates)[len(scores) - candidates]
+        keep = np.flatnonzero(self.noun_mask[ids] & (scores >= cutoff) & (scores < threshold))
+        keep = keep[np.argsort(-scores[keep], kind="stable")][:results]
+        return [self.word(ids[k]) for k in keep]
+
+if __name__ == "__main__":
+    # usage: python -m churnalist.embedding_store [fasttext .bin] [store_dir]
+    # or:    python -m churnalist.embedding_store mask [store_dir] (for stores without a noun mask)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = sys.argv[1:]
+    if len(args) > 0 and args[0] == "mask":
+        build_noun_mask(args[1] if len(args) > 1 else EN_STORE)
+        sys.exit()
+    convert(args[0] if len(args) > 0 else EN_BIN, args[1] if len(args) > 1 else EN_STORE)
@@ -0,0 +1,20 @@
+#!/usr/bin/python
+"""Helpers shared by the embedding modules (embedding_store, ann_index, expand_seedwords)
+
+Kept apart so these modules can share them without importing each other.
+"""
+import numpy as np
+
+def unit(matrix):
+    """Return the rows of matrix scaled to unit length (zero rows stay zero)"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def import_fasttext():
+    """Return the fastText module (it was called fastText in older versions)"""
+    try:
+        import fastText as fasttext
+    except ImportError:
+        import fasttext
+    return fasttext
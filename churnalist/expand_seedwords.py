@@ -1,16 +1,19 @@
 #!/usr/bin/python
 import re
-import nltk
-import gensim
-import requests
+import logging
+from churnalist import metrics
+from churnalist import embedding_store
+from churnalist import conceptnet
+from churnalist.paths import data_path
+from churnalist.embedding_utils import import_fasttext
 
-try:
-    import fastText as fasttext
-except ImportError:
-    import fasttext
+log = logging.getLogger(__name__)
+
+# nltk, gensim and fastText are imported when they are needed: importing
+# them takes seconds, and most users of this module only need one of them
 
 class LazyFastText:
-    def __init__(self, lang):
+    def __init__(self, lang, nprobe=None, store_dir=None):
         """
         We work with both the fastText library and gensim, because both provide handy utitily
         functions. Gensim has functions like most_similar(word) and similar_by_vector(vector),
@@ -25,8 +28,17 @@ class LazyFastText:
         embedding_dict.save_word2vec_format(dictFileName+".bin", binary=True)
         embedding_dict = gensim.models.KeyedVectors.load_word2vec_format(dictFileName+".bin", binary=True)
 
+        The "en_mmap" option opens an embedding store made with
+        python -m churnalist.embedding_store (see embedding_store.py). The store is
+        memory-mapped read-only, so it opens in well under a second and processes on
+        the same machine share one copy of the model. The store replaces both models.
+
         Keyword arguments:
-        self._lang -- language "nl" or "en" (default: "nl") or "en_gensimfast"
+        self._lang -- language "nl" or "en" (default: "nl"), "en_gensimfast" or "en_mmap"
+        self.nprobe -- with "en_mmap" and an IVF index in the store (see ann_index.py),
+                       search only the nprobe closest clusters instead of the whole vocabulary.
+                       Higher values give better recall and slower lookups (default: None, exact search)
+        self.store_dir -- embedding store for "en_mmap" (default: embedding_store.EN_STORE)
 
         Created:
         self._gmodel -- language model for lang in gensim's word2vec_format
@@ -34,6 +46,8 @@ class LazyFastText:
         """
 
         self.lang = lang
+        self.nprobe = nprobe
+        self.store_dir = store_dir if store_dir is not None else embedding_store.EN_STORE
         self._gmodel = None
         self._fmodel = None
 
@@ -61,13 +75,39 @@ class LazyFastText:
         #get related words    
         if candidates < 0 or results < 0:
             raise ValueError
+        # the embedding store has the noun filter precomputed for its whole vocabulary
+        if isinstance(self._gmodel, embedding_store.EmbeddingStore) and self._gmodel.noun_mask is not None:
+            if metrics.get_sink() is not None and word not in self._gmodel:
+                metrics.count("fasttext_oov")
+            return self._gmodel.related_nouns(word, candidates, results, threshold, self.nprobe)
         try:
             candidates = self._gmodel.similar_by_word(word, candidates)
         except KeyError:
+            metrics.count("fasttext_oov")
             word_vector = self._fmodel.get_word_vector(word)
             candidates = self._gmodel.similar_by_word(word_vector, candidates)
+        import nltk
         return [w[0] for w in candidates if not re.findall('[^A-Za-z]+', w[0]) and nltk.pos_tag(nltk.word_tokenize(w[0]))[0][1] in ["NN", "NNS"] and w[1] < threshold][:results]
 
+    def get_related_words_batch(self, words, lang="en", candidates=1000, results=10, threshold=0.6):
+        """Given a list of words, return a dictionary with the similar words (by vector) of every word
+
+        With the "en_mmap" embedding store, all words are looked up in a single
+        pass over the vocabulary. Other models look up the words one by one.
+        The filters are the same as those of get_related_words().
+
+        Keyword arguments:
+        words -- target words for which we want similar words
+        lang, candidates, results, threshold -- see get_related_words()
+        """
+        if self._gmodel == None or self._fmodel == None:
+            self._load_models()
+        if candidates < 0 or results < 0:
+            raise ValueError
+        if isinstance(self._gmodel, embedding_store.EmbeddingStore) and self._gmodel.noun_mask is not None and self.nprobe is None:
+            return self._gmodel.related_nouns_batch(words, candidates, results, threshold)
+        return {word: self.get_related_words(word, lang, candidates, results, threshold) for word in words}
+
     def _load_models(self):
         """Utility function for loading the fastText models into gensim and fasttext
 
@@ -76,28 +116,36 @@ class LazyFastText:
         fmodel -- language model for lang in fastText format
         """
         # dutch
-        NL_model_vec = "../data/fasttext/wiki.nl.vec"
-        NL_model_bin = "../data/fasttext/wiki.nl.bin"
+        NL_model_vec = data_path("fasttext", "wiki.nl.vec")
+        NL_model_bin = data_path("fasttext", "wiki.nl.bin")
         # english
-        EN_model_vec = "../data/fasttext/wiki.en.vec"
-        EN_model_bin = "../data/fasttext/wiki.en.bin"
-        EN_model_gensim_bin = "../data/fasttext/wiki.en.gensim.bin"
+        EN_model_vec = data_path("fasttext", "wiki.en.vec")
+        EN_model_bin = data_path("fasttext", "wiki.en.bin")
+        EN_model_gensim_bin = data_path("fasttext", "wiki.en.gensim.bin")
+        EN_model_store = self.store_dir
+        if self.lang != "en_mmap":
+            import gensim
+            fasttext = import_fasttext()
 
         if self.lang == "nl":
-            print("Loading fastText model in gensim...")
+            log.info("Loading fastText model in gensim...")
             self._gmodel = gensim.models.KeyedVectors.load_word2vec_format(NL_model_vec, binary=False)
-            print("Loading fastText model in fastText...")
+            log.info("Loading fastText model in fastText...")
             self._fmodel = fasttext.load_model(NL_model_bin)
         elif self.lang == "en":
-            print("Loading fastText model in gensim...")
+            log.info("Loading fastText model in gensim...")
             self._gmodel = gensim.models.KeyedVectors.load_word2vec_format(EN_model_vec, binary=False)
-            print("Loading fastText model in fastText...")
+            log.info("Loading fastText model in fastText...")
             self._fmodel = fasttext.load_model(EN_model_bin)
         elif self.lang == "en_gensimfast":
-            print("Loading fastText model in gensim...")
+            log.info("Loading fastText model in gensim...")
             self._gmodel = gensim.models.KeyedVectors.load_word2vec_format(EN_model_gensim_bin, binary=True)
-            print("Loading fastText model in fastText...")
+            log.info("Loading fastText model in fastText...")
             self._fmodel = fasttext.load_model(EN_model_bin)  
+        elif self.lang == "en_mmap":
+            log.info("Opening memory-mapped embedding store...")
+            self._gmodel = embedding_store.EmbeddingStore(EN_model_store)
+            self._fmodel = self._gmodel
         else:
             pass
 
@@ -124,21 +172,49 @@ def get_related_words(method, word, lang, results, fasttextwrapper):
     else:
         raise ValueError("Please specify a method for getting related words: 'fasttext' or 'conceptnet'")
 
+def get_related_words_batch(method, words, lang, results, fasttextwrapper):
+    """Given a list of words, return a dictionary with the similar words of every word according to arg method.
+
+    Keyword arguments:
+    method -- "fasttext" or "conceptnet"
+    words -- target words for which we want similar words
+    lang -- language "nl" or "en"
+    results -- number of words to return per word
+    """
+    if method == "fasttext":
+        if lang=="en":
+            return fasttextwrapper.get_related_words_batch(words, lang, 1000, results, 0.6)
+        else:
+            raise Warning("This function has not been implemented for languages other than English yet.")
+    elif method == "conceptnet":
+        api_results = conceptnet.get_client().related_many(words, lang)
+        return {word: filter_related_words_conceptnet(api_results[word], results, 0.5, 1) for word in words}
+    else:
+        raise ValueError("Please specify a method for getting related words: 'fasttext' or 'conceptnet'")
+
 def get_related_words_conceptnet(word, lang, results, min_threshold, max_threshold):
     # do conceptnet api request for related words in specific language
-    try:
-        api_result = requests.get("http://api.conceptnet.io/related/c/" + lang + "/" + word + "?filter=/c/" + lang).json()
-    except Error as e:
-        print(e, type(e))
+    # (pooled, cached and with a timeout, see conceptnet.py)
+    api_result = conceptnet.get_client().related(word, lang)
+    return filter_related_words_conceptnet(api_result, results, min_threshold, max_threshold)
+
+def filter_related_words_conceptnet(api_result, results, min_threshold, max_threshold):
+    """Return at most results related words from a ConceptNet API result
+
+    Keyword arguments:
+    api_result -- json result of the /related API, or None if the request failed
+    results -- number of words to return
+    min_threshold, max_threshold -- only keep words with a weight between these values
+    """
+    if api_result is None:
         return []
     # filter related words on min and max threshold
     related_words = [rw for rw in api_result['related'] if rw['weight'] > min_threshold and rw['weight'] < max_threshold]
     # post-process words from result: extract from json and remove underscores
     try:
         related_words_str = [re.sub("_"," ",rw['@id'].split("/")[3]) for rw in related_words]
-    except Error as e:
+    except (KeyError, IndexError) as e:
         raise ValueError("something went wrong post-processing the related words:", str(related_words))
-        pass
     if len(related_words_str) > results:
         return related_words_str[:results]
     else:
@@ -0,0 +1,316 @@
+#!/usr/bin/python
+"""Headline generation
+
+A HeadlineGenerator turns seed words into headlines: it samples headlines
+from the corpus, takes their object (and sometimes their subject) as
+substitution target, replaces it with a conjugated seed word and drops
+results with blacklisted words. Targets are read from the annotation store
+if there is one (see annotation_store.py); otherwise a whole batch of sampled
+headlines is parsed at once with nlp.pipe.
+
+With a store, headlines are only drawn from the records that are known to
+have an object (and, for subject swaps, a subject), so every draw yields a
+target and no headlines are sampled in vain.
+
+generate_batch() is the entry point for bulk generation, e.g. flavour text packs:
+
+    from churnalist import generation
+    headlines = generation.generate_batch(["dragon", "wizards"], 1000, seed=42)
+
+generate_parallel() does the same with a pool of worker processes.
+
+With prefetch=True, a background thread keeps a queue of targets ready (see
+prefetch.py), so a stream of headlines doesn't stall every batch_size-th
+headline while a new batch is sampled and parsed.
+"""
+import time
+import array
+import random
+import hashlib
+import threading
+import multiprocessing
+from churnalist import metrics
+from churnalist import pipelines
+from churnalist import prefetch as pf
+from churnalist import annotation_store
+from churnalist import line_index
+from churnalist import blacklist as bl
+from churnalist import keyword_extraction as ke
+from churnalist import topic_substitution as ts
+
+BLACKLIST = ["rape","sex","war","iraq","iran","kill","gay","murder","troops","terror"]
+
+# give up if this many headlines in a row are rejected or have no target
+MAX_ATTEMPTS = 1000
+
+# record ids of a store that have the right targets and pass the blacklist,
+# keyed by store, blacklist and target filters
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _intersect(a, b):
+    """Return the ids that are in both sorted id arrays, as an array("I")"""
+    import numpy as np # only needed with a store and prefilter
+    dtype = np.dtype("uint%d" % (8 * a.itemsize))
+    common = np.intersect1d(np.frombuffer(a, dtype), np.frombuffer(b, dtype), assume_unique=True)
+    return array.array("I", common.astype(dtype).tobytes())
+
+def _target_pool(store, blacklist, prefilter, subject, number, max_length):
+    """Return the ids of the store records to sample from, see HeadlineGenerator"""
+    ids = store.target_ids(subject, number, max_length)
+    if not prefilter or len(blacklist) == 0:
+        return ids
+    key = (store.store_dir, tuple(blacklist.words), blacklist.whole_words, subject, number, max_length)
+    with _pools_lock:
+        pool = _pools.get(key)
+    if pool is None:
+        allowed = bl.prefilter(store.store_dir, len(store), store.headline, blacklist)
+        pool = _intersect(ids, allowed)
+        with _pools_lock:
+            _pools[key] = pool
+    return pool
+
+class HeadlineGenerator:
+    def __init__(self, seedwords, blacklist=BLACKLIST, lang="en", store=None, seed=None, subject_rate=0.1, batch_size=64, prefilter=False, target_number=None, max_target_length=None, targets=None, parser=None, prefetch=False, low_watermark=64, high_watermark=256):
+        """Prepare generation for a list of seed words
+
+        Keyword arguments:
+        seedwords -- words to put in the headlines
+        blacklist -- list of words or a Blacklist, headlines containing one of these are dropped
+        lang -- language "nl" or "en" (we only have English headlines)
+        store -- AnnotationStore with precomputed targets, or None to parse headlines
+        seed -- seed for the random number generator, for reproducible output
+        subject_rate -- chance that the subject is replaced as well
+        batch_size -- number of headlines to sample (and parse) at a time
+        prefilter -- only sample headlines that don't contain blacklisted words themselves
+                     (the corpus is scanned once per process and blacklist)
+        target_number -- only replace objects that are "singular" or "plural" (default: any)
+        max_target_length -- only replace objects of at most this many characters (default: any)
+        targets -- targets to use first, e.g. from sample_targets() of an earlier generator
+        parser -- function that parses a list of sentences and returns the docs, e.g. the parse
+                  method of a batching.ParseService (default: keyword_extraction.parse_sentences)
+        prefetch -- sample targets in a background thread, call close() when done
+        low_watermark -- with prefetch, start sampling when this many targets or fewer are ready
+        high_watermark -- with prefetch, stop sampling when this many targets are ready
+
+        Seed words with blacklisted words are left out right away.
+        """
+        self.blacklist = blacklist if isinstance(blacklist, bl.Blacklist) else bl.Blacklist(blacklist)
+        self.seedwords = [s for s in seedwords if s.strip() != "" and not self.blacklist.matches(s)]
+        if len(self.seedwords) == 0:
+            raise ValueError("Please specify at least one seed word that is not blacklisted")
+        self.lang = lang
+        self.store = store
+        self.rng = random.Random(seed)
+        self.subject_rate = subject_rate
+        self.batch_size = batch_size
+        self.target_number = target_number
+        self.max_target_length = max_target_length
+        self.parser = parser
+        self._stash = list(targets) if targets is not None else []
+        self.rng.shuffle(self._stash)
+        self._allowed = None # ids of headlines that passed the prefilter, or None for all
+        if store is not None:
+            # ids of records with an object, and of records with an object and a subject
+            self._object_pool = _target_pool(store, self.blacklist, prefilter, False, target_number, max_target_length)
+            self._subject_pool = _target_pool(store, self.blacklist, prefilter, True, target_number, max_target_length)
+            if len(self._object_pool) == 0:
+                raise ValueError("The annotation store has no headlines with a matching substitution target")
+        elif prefilter and len(self.blacklist) > 0:
+            if lang == "en":
+                index = line_index.get_index(ts.PLAINTEXT_EN)
+                self._allowed = bl.prefilter(ts.PLAINTEXT_EN, len(index), index.get_line, self.blacklist)
+        # the prefetch thread samples with its own generator, so the output
+        # for a seed doesn't depend on how the threads are scheduled
+        self._sample_rng = random.Random(self.rng.getrandbits(64)) if prefetch else self.rng
+        self._prefetcher = pf.Prefetcher(self._timed_sample, batch_size, low_watermark, high_watermark) if prefetch else None
+        ts.prewarm_inflections(self.seedwords, lang)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        """Stop the prefetch thread, if there is one"""
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+
+    def _swap_subject(self):
+        return self.subject_rate > 0 and self._sample_rng.random() < self.subject_rate
+
+    def _matches_filters(self, obj):
+        if obj is None:
+            return False
+        if self.max_target_length is not None and len(str(obj)) > self.max_target_length:
+            return False
+        return self.target_number is None or ts._target_number(obj, self.lang) == self.target_number
+
+    def _sample_targets(self, k):
+        """Return (headline, object, subject or None) for k random headlines
+
+        The subject is only given for the headlines (chance subject_rate) where it
+        should be replaced as well. With a store, exactly k targets are returned;
+        otherwise the headlines without (matching) object are left out.
+        """
+        if self.store is not None:
+            rows = []
+            for i in range(0, k):
+                if len(self._subject_pool) > 0 and self._swap_subject():
+                    rows.append(self.store.get(self._subject_pool[self._sample_rng.randrange(len(self._subject_pool))]))
+                else:
+                    headline, obj, subj = self.store.get(self._object_pool[self._sample_rng.randrange(len(self._object_pool))])
+                    rows.append((headline, obj, None))
+            return rows
+        headlines = ts.get_n_random_headlines(self.lang, k, self._sample_rng, self._allowed)
+        sentences = [h.rstrip("\n") for h in headlines]
+        if self.parser is not None:
+            docs = self.parser(sentences)
+        else:
+            docs = ke.parse_sentences(sentences, self.lang, pipelines.NO_NER, batch_size=k)
+        rows = []
+        for headline, doc in zip(headlines, docs):
+            obj = ts.find_obj_in_doc(doc)
+            if self._matches_filters(obj):
+                subj = ts.find_subj_in_doc(doc)
+                rows.append((headline, obj, subj if subj is not None and self._swap_subject() else None))
+        return rows
+
+    def sample_targets(self, k):
+        """Return a list of at most k new (headline, object, subject) targets
+
+        These do not depend on the seed words, so they can be handed to
+        another generator with the targets argument.
+        """
+        return self._sample_targets(k)
+
+    def _timed_sample(self, k):
+        with metrics.stage("sample_targets"):
+            targets = self._sample_targets(k)
+        metrics.count("target_samples")
+        return targets
+
+    def _next_target(self):
+        if self._stash:
+            return self._stash.pop()
+        if self._prefetcher is not None:
+            return self._prefetcher.get()
+        for attempt in range(0, MAX_ATTEMPTS):
+            if attempt > 0: # the last batch had no usable target
+                metrics.count("target_search_retries")
+            self._stash = self._timed_sample(self.batch_size)
+            if self._stash:
+                return self._stash.pop()
+        raise ValueError("Could not find headlines with a substitution target")
+
+    def _substitute(self, headline, obj, subj):
+        """Replace the object, and the subject if there is one, by seed words"""
+        new_headline = ts.substitute(headline, self.rng.choice(self.seedwords), self.lang, obj)
+        if subj is not None:
+            new_headline = ts.substitute(new_headline, self.rng.choice(self.seedwords), self.lang, subj)
+        return new_headline.strip()
+
+    def is_banned(self, headline):
+        """Return True if headline contains a blacklisted word"""
+        return self.blacklist.matches(headline)
+
+    def next_headline(self):
+        """Return one new headline that passes the blacklist"""
+        start = time.perf_counter()
+        for attempt in range(0, MAX_ATTEMPTS):
+            headline = self._substitute(*self._next_target())
+            if not self.is_banned(headline):
+                metrics.count("headlines_generated")
+                metrics.observe("headline_seconds", time.perf_counter() - start)
+                return headline
+            metrics.count("blacklist_rejections")
+        raise ValueError("All generated headlines were blacklisted, check the seed words and the blacklist")
+
+    def generate(self, n):
+        """Yield exactly n headlines, one at a time"""
+        if n < 0:
+            raise ValueError("n for generate(n) can't be lower than 0")
+        for i in range(0, n):
+            yield self.next_headline()
+
+    def generate_batch(self, n):
+        """Return a list of exactly n headlines
+
+        All targets that are needed are sampled (and parsed) in one go,
+        with some extra for headlines that are rejected, unless they are prefetched.
+        """
+        if n < 0:
+            raise ValueError("n for generate_batch(n) can't be lower than 0")
+        if n > len(self._stash) and self._prefetcher is None:
+            with metrics.stage("sample_targets"):
+                self._stash.extend(self._sample_targets(n - len(self._stash) + n // 10 + 1))
+        return list(self.generate(n))
+
+def generate_batch(seedwords, n, seed=None, blacklist=BLACKLIST, lang="en", store=None, prefilter=False):
+    """Return a list of exactly n headlines for seedwords
+
+    Keyword arguments:
+    seedwords -- words to put in the headlines
+    n -- number of headlines
+    seed -- seed for the random number generator, for reproducible output
+    blacklist -- headlines containing one of these words are dropped
+    lang -- language "nl" or "en"
+    store -- AnnotationStore with precomputed targets, or None to parse headlines
+    prefilter -- skip headlines with blacklisted words before generation
+    """
+    return HeadlineGenerator(seedwords, blacklist, lang, store, seed, prefilter=prefilter).generate_batch(n)
+
+def chunk_seed(seed, chunk_no):
+    """Derive the seed of chunk chunk_no from the master seed"""
+    digest = hashlib.sha256(("%s:%d" % (seed, chunk_no)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+# every worker process opens the annotation store once, see _init_worker()
+_worker_store = None
+
+def _init_worker(lang, store_dir):
+    global _worker_store
+    if store_dir is not None:
+        _worker_store = annotation_store.AnnotationStore(store_dir)
+    else:
+        pipelines.preload([lang], pipelines.NO_NER)
+
+def _generate_chunk(args):
+    seedwords, count, seed, blacklist, lang, prefilter = args
+    return HeadlineGenerator(seedwords, blacklist, lang, _worker_store, seed, prefilter=prefilter).generate_batch(count)
+
+def generate_parallel(seedwords, n, seed=None, processes=None, chunk_size=1000, blacklist=BLACKLIST, lang="en", store_dir=None, prefilter=False):
+    """Return a list of exactly n headlines, generated by a pool of worker processes
+
+    The work is cut into chunks of chunk_size headlines. Every chunk gets its own
+    random number generator, seeded with chunk_seed(seed, chunk number), and the
+    chunks are put back together in order. The output for a given seed therefore
+    does not depend on the number of processes.
+    Every worker loads its own spaCy pipeline, or opens the annotation store.
+
+    Keyword arguments:
+    seedwords -- words to put in the headlines
+    n -- number of headlines
+    seed -- master seed (default: None, a random seed)
+    processes -- number of worker processes (default: number of cores)
+    chunk_size -- number of headlines per chunk
+    blacklist -- headlines containing one of these words are dropped
+    lang -- language "nl" or "en"
+    store_dir -- directory of an annotation store, or None to parse headlines
+    prefilter -- skip headlines with blacklisted words before generation
+    """
+    if n < 0:
+        raise ValueError("n for generate_parallel(n) can't be lower than 0")
+    if chunk_size <= 0:
+        raise ValueError("chunk_size should be positive")
+    if seed is None:
+        seed = random.randrange(2**63)
+    seedwords = list(seedwords)
+    jobs = [(seedwords, min(chunk_size, n - start), chunk_seed(seed, chunk_no), blacklist, lang, prefilter) for chunk_no, start in enumerate(range(0, n, chunk_size))]
+    headlines = []
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(lang, store_dir)) as pool:
+        for chunk in pool.imap(_generate_chunk, jobs):
+            headlines.extend(chunk)
+    return headlines
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+"""Import-time and import-memory budget of the churnalist modules
+
+Heavy libraries (spaCy, nltk, gensim, fastText, pattern3, requests) are only
+imported by the functions that need them, so a script that only samples
+headlines does not pay seconds and hundreds of MB for the NLP stack.
+This check keeps it that way: every module is imported in a fresh Python
+process, which reports the import time, the growth of its peak memory and
+the heavy libraries that were loaded.
+
+    python -m churnalist.import_budget    # exit status 1 if a module is over budget
+
+tests/test_import_budget.py runs the same check with pytest, with ten times
+the time budgets so that a busy test machine doesn't fail it.
+"""
+import os
+import sys
+import json
+import subprocess
+
+# libraries that should never be loaded by importing a churnalist module
+HEAVY = ["spacy", "nltk", "gensim", "fastText", "fasttext", "pattern3", "requests", "flask"]
+
+# module -> (seconds, MB); the numpy-based modules get more room
+BUDGETS = {
+    "churnalist.paths": (0.2, 10),
+    "churnalist.pipelines": (0.2, 10),
+    "churnalist.line_index": (0.2, 10),
+    "churnalist.blacklist": (0.2, 10),
+    "churnalist.session_cache": (0.2, 10),
+    "churnalist.topic_substitution": (0.2, 10),
+    "churnalist.keyword_extraction": (0.3, 15),
+    "churnalist.annotation_store": (0.3, 15),
+    "churnalist.generation": (0.3, 15),
+    "churnalist.async_generation": (0.3, 15),
+    "churnalist.metrics": (0.2, 10),
+    "churnalist.batching": (0.3, 15),
+    "churnalist.prefetch": (0.2, 10),
+    "churnalist.conceptnet": (0.3, 15),
+    "churnalist.embedding_utils": (1.0, 50),
+    "churnalist.ann_index": (1.0, 50),
+    "churnalist.embedding_store": (1.0, 50),
+    "churnalist.quantize": (1.0, 50),
+    "churnalist.expand_seedwords": (1.0, 50),
+}
+
+# the directory that contains the churnalist package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in the fresh process; ru_maxrss is in kB on Linux
+MEASURE = """
+import sys, time, json, resource, importlib
+before = set(sys.modules)
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024.0
+loaded = sorted(set(m.split(".")[0] for m in set(sys.modules) - before))
+print(json.dumps({"seconds": seconds, "mb": mb, "loaded": loaded}))
+"""
+
+def measure(module):
+    """Import module in a fresh process and return {"seconds", "mb", "loaded"}"""
+    output = subprocess.check_output([sys.executable, "-c", MEASURE, module], cwd=ROOT)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+def check(budgets=BUDGETS, time_factor=1.0):
+    """Measure every module in budgets and return a list of problems (empty if all are within budget)
+
+    Keyword arguments:
+    budgets -- {module: (seconds, MB)}
+    time_factor -- multiply the time budgets by this, e.g. for slow or busy machines
+                   (None: don't check the time at all)
+    """
+    problems = []
+    for module, (max_seconds, max_mb) in sorted(budgets.items()):
+        result = measure(module)
+        heavy = [name for name in result["loaded"] if name in HEAVY]
+        print("%-32s %6.3f s %6.1f MB %s" % (module, result["seconds"], result["mb"], " ".join(heavy)))
+        if heavy:
+            problems.append("%s imports %s" % (module, ", ".join(heavy)))
+        if time_factor is not None and result["seconds"] > max_seconds * time_factor:
+            problems.append("%s takes %.3f s to import (budget: %.3f s)" % (module, result["seconds"], max_seconds * time_factor))
+        if result["mb"] > max_mb:
+            problems.append("%s uses %.1f MB to import (budget: %.1f MB)" % (module, result["mb"], max_mb))
+    return problems
+
+if __name__ == "__main__":
+    problems = check()
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
@@ -1,6 +1,15 @@
 #!/usr/bin/python
-import nltk
-import spacy
+import logging
+import itertools
+import multiprocessing
+from churnalist import metrics
+from churnalist import pipelines
+from churnalist.paths import data_path
+
+log = logging.getLogger(__name__)
+
+# nltk and spaCy are imported in the functions that use them, so importing
+# this module stays cheap (see import_budget.py)
 
 def parse_plaintext(filename):
     """Open a plaintext file with input text and tokenize into sentences
@@ -8,6 +17,7 @@ def parse_plaintext(filename):
     Keyword arguments:
     filename -- filename of the plaintext file with input text
     """
+    import nltk
     # get input from a plaintext file
     t = ""
     with open(filename, "r") as infile:
@@ -15,7 +25,96 @@ def parse_plaintext(filename):
     sentences = nltk.sent_tokenize(t)
     return sentences
 
-def get_noun_list(sentences, lang="nl"):
+def stream_sentences(filename, chunk_size=1048576):
+    """Read a plaintext file chunk_size characters at a time and yield its sentences one by one
+
+    Unlike parse_plaintext(), this never holds more than one chunk and the
+    unfinished sentence at its end in memory, so it works for files of any size.
+    A "sentence" that grows longer than chunk_size without a sentence boundary
+    is yielded in pieces of at most 2 * chunk_size characters.
+
+    Keyword arguments:
+    filename -- filename of the plaintext file with input text
+    chunk_size -- number of characters to read at a time (default: 1 MB)
+    """
+    import nltk
+    # the tokenizer that nltk.sent_tokenize() uses, we need its sentence offsets
+    tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+    rest = ""
+    with open(filename, "r") as infile:
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                break
+            text = rest + chunk
+            spans = list(tokenizer.span_tokenize(text))
+            if not spans: # only whitespace so far
+                rest = ""
+                continue
+            # the last sentence might continue in the next chunk
+            for start, end in spans[:-1]:
+                yield text[start:end]
+            rest = text[spans[-1][0]:]
+            if len(rest) > chunk_size: # no boundary in sight, don't let it grow (and be re-tokenized) forever
+                yield rest.strip()
+                rest = ""
+    if rest.strip():
+        yield rest.strip()
+
+def _batches(sentences, batch_size):
+    """Yield lists of at most batch_size sentences"""
+    it = iter(sentences)
+    batch = list(itertools.islice(it, batch_size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(it, batch_size))
+
+def _parse_batch(args):
+    """Parse a batch of sentences in a worker process and return the serialized docs"""
+    lang, disable, sentences = args
+    nlp = pipelines.get_pipeline(lang, disable)
+    return [doc.to_bytes() for doc in nlp.pipe(sentences, batch_size=len(sentences))]
+
+def parse_sentences(sentences, lang, disable=pipelines.NO_NER, batch_size=1000, n_process=1):
+    """Parse sentences with spaCy's nlp.pipe and yield one Doc per sentence, in order
+
+    With n_process > 1, batches of sentences are parsed by a pool of worker processes
+    that each load their own pipeline. The workers send back serialized docs that
+    are restored with the vocabulary of this process, so the result is the same
+    as parsing everything here.
+
+    Keyword arguments:
+    sentences -- a list of sentences, from nltk.sent_tokenize()
+    lang -- language "nl" or "en"
+    disable -- pipeline components to leave out (default: pipelines.NO_NER)
+    batch_size -- number of sentences per nlp.pipe() batch
+    n_process -- number of processes to parse with (default: 1, parse in this process)
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size should be positive")
+    nlp = pipelines.get_pipeline(lang, disable)
+    metrics.count("parse_calls")
+    if n_process <= 1:
+        for doc in nlp.pipe(sentences, batch_size=batch_size):
+            metrics.count("parsed_sentences")
+            yield doc
+        return
+    from spacy.tokens import Doc
+    with multiprocessing.Pool(n_process, initializer=pipelines.preload, initargs=([lang], disable)) as pool:
+        # keep at most 2 batches per process in flight, so sentences can be a stream
+        pending = []
+        for batch in _batches(sentences, batch_size):
+            pending.append(pool.apply_async(_parse_batch, ((lang, disable, batch),)))
+            if len(pending) >= 2 * n_process:
+                for doc_bytes in pending.pop(0).get():
+                    metrics.count("parsed_sentences")
+                    yield Doc(nlp.vocab).from_bytes(doc_bytes)
+        for result in pending:
+            for doc_bytes in result.get():
+                metrics.count("parsed_sentences")
+                yield Doc(nlp.vocab).from_bytes(doc_bytes)
+
+def get_noun_list(sentences, lang="nl", batch_size=1000, n_process=1):
     """From a list of sentences, return a list of all nouns
 
     we're using the default spacy datasets for en and nl
@@ -27,19 +126,20 @@ def get_noun_list(sentences, lang="nl"):
 
     Todo:
     propernames
+
+    Keyword arguments:
+    sentences -- a list of sentences, from nltk.sent_tokenize()
+    lang -- language "nl" or "en" (default: "nl")
+    batch_size -- number of sentences per nlp.pipe() batch
+    n_process -- number of processes to parse with
     """
     nouns = []
     parserinfo = []
     nouninfo = {}
 
-    if lang == "nl":
-        nlp = spacy.load('nl_core_news_sm')
-    elif lang == "en":
-        nlp = spacy.load('en_core_web_sm')
-    else:
+    if lang not in ["nl", "en"]:
         raise ValueError('Please specify the input language (valid options: "nl", "en")')
-    for sentence in sentences:
-        doc = nlp(sentence)
+    for doc in parse_sentences(sentences, lang, pipelines.NO_NER, batch_size, n_process):
         parserinfo.append(doc)
         for token in doc:
             #print(token.text, token.pos_, token.tag_, token.dep_)
@@ -52,7 +152,19 @@ def get_noun_list(sentences, lang="nl"):
                     nouninfo[token.text.lower()] = token.tag_
     return parserinfo, nouns, nouninfo
 
-def get_noun_chunk_list(sentences, lang="en", drop_detposs="true"):
+def _iter_noun_chunks(doc, stopwords, drop_detposs):
+    """Yield (root noun, noun phrase) for the noun chunks of doc that we want to keep"""
+    for nc in doc.noun_chunks: #nc is a span
+        if nc.as_doc()[0].pos_ == "PRON":
+            continue # this is a pronoun, skip this nounchunk
+        if nc.root.text.lower() in stopwords:
+            continue
+        if drop_detposs and nc.as_doc()[0].dep_ in ['det', 'poss']: # if we want to drop the determiners and possesives, remove these from the nc
+            yield nc.root.text, nc.as_doc()[1:]
+        else:
+            yield nc.root.text, nc
+
+def get_noun_chunk_list(sentences, lang="en", drop_detposs="true", batch_size=1000, n_process=1):
     """From a list of English sentences, return a list of noun phrases and their root nouns
 
     We skip pronouns and English stopwords
@@ -61,42 +173,72 @@ def get_noun_chunk_list(sentences, lang="en", drop_detposs="true"):
     sentences -- a list of sentences, from nltk.sent_tokenize()
     lang -- language: "en" (this function is only implemented for English)
     drop_detposs -- remove determiners and possessives (default: True)
+    batch_size -- number of sentences per nlp.pipe() batch
+    n_process -- number of processes to parse with
 
     Returns:
     parserinfo -- list of parser-information for every sentence
     noun_chunks -- list of noun phrases from sentences
     noun_dict -- dictionary with root nouns and their related noun phrases
     """
-    if lang == "en":
-        nlp = spacy.load('en_core_web_sm')
-    else:
+    if lang != "en":
         raise ValueError('Please specify the input language (valid options: "en")')
     noun_chunks = []
     parserinfo = []
     noun_dict = {}
     # remove all noun phrases that have an English stopword as their root
+    import nltk
     stopwords = set(nltk.corpus.stopwords.words('english'))
 
-    for s in sentences:
-        doc = nlp(s)
+    for doc in parse_sentences(sentences, lang, pipelines.NO_NER, batch_size, n_process):
         parserinfo.append(doc)
-        for nc in doc.noun_chunks: #nc is a span
-            if nc.as_doc()[0].pos_ == "PRON":
-                continue # this is a pronoun, skip this nounchunk
-            if nc.root.text.lower() in stopwords:
-                continue
-            if nc.root.text not in noun_dict:
-                noun_dict[nc.root.text] = []
-            if drop_detposs and nc.as_doc()[0].dep_ in ['det', 'poss']: # if we want to drop the determiners and possesives, remove these from the nc
-                noun_chunks.append(nc.as_doc()[1:])
-                noun_dict[nc.root.text].append(nc.as_doc()[1:])
-
-            else:
-                noun_chunks.append(nc)
-                noun_dict[nc.root.text].append(nc)
+        for root, nc in _iter_noun_chunks(doc, stopwords, drop_detposs):
+            if root not in noun_dict:
+                noun_dict[root] = []
+            noun_chunks.append(nc)
+            noun_dict[root].append(nc)
 
     return parserinfo, noun_chunks, noun_dict
 
+def get_noun_dict_streaming(filename, lang="en", drop_detposs="true", batch_size=1000, n_process=1, keep_parses=False):
+    """Build the noun_dict of get_noun_chunk_list() for a plaintext file of any size
+
+    Sentences are read with stream_sentences() and every parsed sentence is
+    folded into noun_dict right away. By default, noun_dict holds the distinct
+    noun phrases as strings, so no parse objects are kept and peak memory
+    depends on the vocabulary of the text, not on its length.
+
+    Keyword arguments:
+    filename -- filename of the plaintext file with input text
+    lang -- language: "en" (this function is only implemented for English)
+    drop_detposs -- remove determiners and possessives (default: True)
+    batch_size -- number of sentences per nlp.pipe() batch
+    n_process -- number of processes to parse with
+    keep_parses -- keep the noun phrase spans (and with them their parses)
+                   instead of strings, like get_noun_chunk_list() (default: False)
+
+    Returns:
+    noun_dict -- dictionary with root nouns and their related noun phrases
+    """
+    if lang != "en":
+        raise ValueError('Please specify the input language (valid options: "en")')
+    noun_dict = {}
+    import nltk
+    stopwords = set(nltk.corpus.stopwords.words('english'))
+    seen = {} # root -> set of its phrases in noun_dict, for fast duplicate checks
+    sentences = stream_sentences(filename)
+    for doc in parse_sentences(sentences, lang, pipelines.NO_NER, batch_size, n_process):
+        for root, nc in _iter_noun_chunks(doc, stopwords, drop_detposs):
+            if root not in noun_dict:
+                noun_dict[root] = []
+                seen[root] = set()
+            if keep_parses:
+                noun_dict[root].append(nc)
+            elif nc.text not in seen[root]:
+                seen[root].add(nc.text)
+                noun_dict[root].append(nc.text)
+    return noun_dict
+
 def freqdist(nouns, top_n):
     """Given a list of nouns, print the most n frequest words and return a FreqDist object
 
@@ -111,6 +253,7 @@ def freqdist(nouns, top_n):
     # note that this might be a bad idea for proper names and jargon ("ROT13")
     nouns_lower = [n.lower() for n in nouns]
     # Calculate frequency distribution
+    import nltk
     fdist = nltk.FreqDist(nouns_lower)
     # Output top 50 words
     for word, frequency in fdist.most_common(top_n):
@@ -138,7 +281,7 @@ def get_seed_words(filename, lang="nl"):
 
 def test_keyword_extraction():
     """Test keyword extraction with a test file"""
-    sentences = parse_plaintext("../data/publication_story.txt")
+    sentences = parse_plaintext(data_path("publication_story.txt"))
     print(sentences)
     print(get_noun_chunk_list(sentences))
     
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+"""Random access to the lines of a large plaintext file
+
+A LineIndex keeps the byte offset of every line of a file in an index file
+next to it (filename + ".idx"). The file itself is read through mmap, so
+fetching line i is one seek and no copy of the whole file is made.
+The index is rebuilt when the size or modification time of the file change.
+"""
+import os
+import mmap
+import array
+import random
+import struct
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx"
+# size and modification time (ns) of the indexed file
+INDEX_HEADER = struct.Struct("<QQ")
+
+_indexes = {}
+_lock = threading.Lock()
+
+class LineIndex:
+    def __init__(self, filename):
+        """Open filename and load or build its line-offset index
+
+        Keyword arguments:
+        filename -- plaintext file with one item (e.g. a headline) per line
+        """
+        self.filename = filename
+        stat = os.stat(filename)
+        self._stamp = (stat.st_size, stat.st_mtime_ns)
+        self._offsets = self._load_index()
+        if self._offsets is None:
+            self._offsets = self._build_index()
+        if stat.st_size > 0:
+            with open(filename, "rb") as infile:
+                self._data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    def _load_index(self):
+        """Return the offsets from the index file, or None if it is missing or outdated"""
+        try:
+            with open(self.filename + INDEX_SUFFIX, "rb") as infile:
+                header = infile.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size or INDEX_HEADER.unpack(header) != self._stamp:
+                    return None
+                offsets = array.array("Q")
+                offsets.frombytes(infile.read())
+                return offsets
+        except OSError:
+            return None
+
+    def _build_index(self):
+        """Scan the file once for line ends and save the offsets to the index file"""
+        log.info("Building line index for %s", self.filename)
+        offsets = array.array("Q", [0])
+        size = self._stamp[0]
+        if size > 0:
+            with open(self.filename, "rb") as infile:
+                data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                pos = data.find(b"\n")
+                while pos != -1:
+                    offsets.append(pos + 1)
+                    pos = data.find(b"\n", pos + 1)
+                data.close()
+        if offsets[-1] != size: # last line without a newline
+            offsets.append(size)
+        tmp = self.filename + INDEX_SUFFIX + ".tmp"
+        try:
+            with open(tmp, "wb") as outfile:
+                outfile.write(INDEX_HEADER.pack(*self._stamp))
+                offsets.tofile(outfile)
+            os.replace(tmp, self.filename + INDEX_SUFFIX)
+        except OSError as e: # e.g. a read-only data folder, we can still use the index
+            log.warning("Could not save line index: %s", e)
+        return offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get_line(self, i):
+        """Return line i of the file (including the newline)"""
+        if i < 0:
+            i += len(self)
+        return self._data[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def sample(self, n, rng=random, ids=None):
+        """Return n random lines (with replacement)
+
+        Keyword arguments:
+        n -- number of lines
+        rng -- random number generator (default: the random module)
+        ids -- only sample from these line numbers (default: all lines)
+        """
+        if ids is None:
+            if len(self) == 0:
+                raise ValueError("%s is empty" % self.filename)
+            return [self.get_line(rng.randrange(len(self))) for i in range(0, n)]
+        if len(ids) == 0:
+            raise ValueError("No lines of %s to sample from" % self.filename)
+        return [self.get_line(ids[rng.randrange(len(ids))]) for i in range(0, n)]
+
+def get_index(filename):
+    """Return the LineIndex for filename, opening it only once per process"""
+    index = _indexes.get(filename)
+    if index is None:
+        with _lock:
+            index = _indexes.get(filename)
+            if index is None:
+                index = LineIndex(filename)
+                _indexes[filename] = index
+    return index
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+"""Instrumentation for the generation pipeline: counters, stage timers and histograms
+
+Instrumentation is off by default. While it is off, count(), observe() and
+timer() return after checking one global, so the calls can stay in the hot
+paths. enable() turns it on with a Registry, or with any object that has the
+same count(name, value) and observe(name, value) methods, e.g. an adapter
+for another metrics system.
+
+    from churnalist import metrics
+    registry = metrics.enable()
+    ... generate headlines ...
+    print(registry.render())   # Prometheus text format
+
+Names used by churnalist:
+parse_calls, parsed_sentences -- spaCy calls (find_subj/find_obj, parse_sentences) and parsed sentences
+target_samples, target_search_retries -- target batches sampled, and batches that had no target
+prefetched_targets, prefetch_waits -- targets sampled by a prefetch thread, and times a headline
+                                      had to wait because none was ready
+blacklist_rejections -- generated headlines dropped by the blacklist
+headlines_generated, headline_seconds -- generated headlines and the latency per headline
+conjugation_failures -- seed words that could not be inflected
+conceptnet_requests, conceptnet_cache_hits, conceptnet_failures -- ConceptNet lookups
+fasttext_fallbacks, fasttext_oov -- words looked up in fastText because ConceptNet had nothing,
+                                    and words that were not in the fastText vocabulary
+stage_seconds_<stage> -- duration of a pipeline stage, e.g. sample_targets or the demo's parse
+"""
+import time
+import bisect
+import threading
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "churnalist_"
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        """Keep counters and histograms in memory
+
+        Keyword arguments:
+        buckets -- upper bounds of the histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {} # name -> [count per bucket (+inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.histograms[name] = histogram
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted(self.counters):
+                lines.append("# TYPE %s%s_total counter" % (PREFIX, name))
+                lines.append("%s%s_total %s" % (PREFIX, name, self.counters[name]))
+            for name in sorted(self.histograms):
+                counts, total, count = self.histograms[name]
+                lines.append("# TYPE %s%s histogram" % (PREFIX, name))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append('%s%s_bucket{le="%s"} %d' % (PREFIX, name, bound, cumulative))
+                lines.append("%s%s_sum %r" % (PREFIX, name, total))
+                lines.append("%s%s_count %d" % (PREFIX, name, count))
+        return "\n".join(lines) + "\n"
+
+_sink = None
+
+def enable(sink=None):
+    """Turn instrumentation on and return the sink (default: a new Registry)"""
+    global _sink
+    _sink = sink if sink is not None else Registry()
+    return _sink
+
+def disable():
+    global _sink
+    _sink = None
+
+def get_sink():
+    """Return the current sink, or None if instrumentation is off"""
+    return _sink
+
+def count(name, value=1):
+    if _sink is not None:
+        _sink.count(name, value)
+
+def observe(name, value):
+    if _sink is not None:
+        _sink.observe(name, value)
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name):
+    """Return a context manager that observes its duration as name (does nothing when off)"""
+    return _Timer(name) if _sink is not None else _NULL_TIMER
+
+def stage(name):
+    """Timer for a pipeline stage, observed as stage_seconds_<name>"""
+    return timer("stage_seconds_" + name) if _sink is not None else _NULL_TIMER
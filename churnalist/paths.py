@@ -0,0 +1,14 @@
+#!/usr/bin/python
+"""Locations of the data files
+
+The data folder is found from the location of this package, not from the
+working directory, so the command line tools and the demo work from any
+folder.
+"""
+import os
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+def data_path(*parts):
+    """Return the path of a file in the data folder, e.g. data_path("headlines.txt")"""
+    return os.path.join(DATA_DIR, *parts)
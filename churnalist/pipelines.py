@@ -0,0 +1,55 @@
+#!/usr/bin/python
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# spaCy model packages per language, see requirements.txt
+MODELS = {"en": "en_core_web_sm", "nl": "nl_core_news_sm"}
+
+# components that the dependency-based functions never look at
+NO_NER = ("ner",)
+
+_pipelines = {}
+_lock = threading.Lock()
+
+def get_pipeline(lang, disable=()):
+    """Return the spaCy pipeline for lang, loading it only once per process
+
+    Pipelines are kept in a process-wide registry keyed by language and
+    the set of disabled components, so a parser-only pipeline and a full
+    pipeline for the same language are separate entries.
+    Loading happens under a lock, so concurrent threads asking for the same
+    pipeline wait for the first load instead of loading the model twice.
+
+    Keyword arguments:
+    lang -- language "nl" or "en"
+    disable -- names of pipeline components to leave out, e.g. ("ner",)
+    """
+    if lang not in MODELS:
+        raise ValueError('Please specify your language of choice: "nl" or "en"')
+    key = (lang, tuple(sorted(disable)))
+    nlp = _pipelines.get(key)
+    if nlp is None:
+        with _lock:
+            nlp = _pipelines.get(key)
+            if nlp is None:
+                log.info("Loading spaCy model %s without %s", MODELS[lang], list(key[1]))
+                import spacy # only when a pipeline is needed, importing spaCy takes seconds
+                nlp = spacy.load(MODELS[lang], disable=list(key[1]))
+                _pipelines[key] = nlp
+    return nlp
+
+def preload(langs=("en",), disable=NO_NER):
+    """Load the pipelines for langs up front, e.g. when a worker process starts
+
+    Keyword arguments:
+    langs -- languages to load
+    disable -- names of pipeline components to leave out (default: NO_NER)
+    """
+    for lang in langs:
+        get_pipeline(lang, disable)
+
+def loaded_pipelines():
+    """Return the (lang, disabled components) keys of all loaded pipelines"""
+    return list(_pipelines.keys())
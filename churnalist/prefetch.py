@@ -0,0 +1,115 @@
+#!/usr/bin/python
+"""Background prefetching of substitution targets
+
+Without prefetching, a HeadlineGenerator samples (and parses) a new batch of
+headlines whenever its stash is empty, so every batch_size-th headline is
+slow. A Prefetcher keeps a bounded queue of ready (headline, object, subject)
+targets that a background thread fills: when the queue drops to the low
+watermark, the thread samples batches until it reaches the high watermark.
+The consumer only dequeues, while the thread fills the queue behind it.
+
+HeadlineGenerator(..., prefetch=True) uses one; call close() on the
+generator (or use it in a with statement) to stop the thread.
+"""
+import os
+import logging
+import threading
+import collections
+from churnalist import metrics
+
+log = logging.getLogger(__name__)
+
+# give up if this many sampled batches in a row have no target
+MAX_EMPTY_BATCHES = 1000
+
+class Prefetcher:
+    def __init__(self, sample, batch_size=64, low_watermark=64, high_watermark=256):
+        """Prepare prefetching, the thread starts with the first get()
+
+        Keyword arguments:
+        sample -- function that returns a list of at most k new targets for sample(k)
+        batch_size -- maximum number of targets to sample at a time
+        low_watermark -- start filling when this many targets or fewer are left
+        high_watermark -- stop filling when this many targets are ready
+        """
+        if batch_size <= 0 or not 0 <= low_watermark < high_watermark:
+            raise ValueError("batch_size should be positive and 0 <= low_watermark < high_watermark")
+        self.sample = sample
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self._ready = collections.deque()
+        self._cond = threading.Condition()
+        self._error = None
+        self._closed = False
+        self._thread = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self._ready)
+
+    def get(self):
+        """Return the next target, waiting for the thread if there is none yet"""
+        if self._pid != os.getpid() and self._pid is not None:
+            # threads don't survive a fork, start another one in this process
+            self._cond = threading.Condition()
+            self._thread = None
+        with self._cond:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="churnalist-prefetch", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            while not self._ready and self._error is None and not self._closed:
+                metrics.count("prefetch_waits")
+                self._cond.wait()
+            if self._ready:
+                target = self._ready.popleft()
+                if len(self._ready) <= self.low_watermark:
+                    self._cond.notify_all()
+                return target
+            if self._error is not None:
+                raise self._error
+            raise ValueError("The prefetcher has been closed")
+
+    def _run(self):
+        empty = 0
+        while True:
+            with self._cond:
+                while len(self._ready) > self.low_watermark and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                missing = self.high_watermark - len(self._ready)
+            # sample without holding the lock, so get() keeps working meanwhile
+            while missing > 0:
+                try:
+                    batch = self.sample(min(self.batch_size, missing))
+                except Exception as e:
+                    log.exception("Prefetching targets failed")
+                    self._fail(e)
+                    return
+                empty = 0 if batch else empty + 1
+                if empty >= MAX_EMPTY_BATCHES:
+                    self._fail(ValueError("Could not find headlines with a substitution target"))
+                    return
+                metrics.count("prefetched_targets", len(batch))
+                with self._cond:
+                    if self._closed:
+                        return
+                    self._ready.extend(batch)
+                    self._cond.notify_all()
+                    missing = self.high_watermark - len(self._ready)
+
+    def _fail(self, error):
+        with self._cond:
+            self._error = error
+            self._cond.notify_all()
+
+    def close(self):
+        """Stop the thread; targets that are ready can still be taken with get()"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
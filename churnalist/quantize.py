@@ -0,0 +1,144 @@
+#!/usr/bin/python
+"""Compact copies of an embedding store
+
+The float32 vectors of wiki.en take 3 GB and the subword vectors another
+2.4 GB. quantize() writes a copy of an embedding store with smaller vectors:
+- "float16": half precision, half the size
+- "int8": every unit vector scaled so its largest value is 127 and rounded,
+  with one float32 scale factor per word, a quarter of the size
+Optionally, only the top_n most frequent words are kept (the words of a
+fastText model are sorted by frequency) and the subword vectors are left out.
+EmbeddingStore reads all variants, so LazyFastText("en_mmap") works as before.
+
+compare_stores() measures what is lost compared to the full store.
+"""
+import os
+import sys
+import json
+import shutil
+import random
+import logging
+import numpy as np
+from churnalist import embedding_store
+
+log = logging.getLogger(__name__)
+
+DTYPES = {"float16": np.float16, "int8": np.int8}
+
+def quantize(store_dir, out_dir, dtype="int8", top_n=None, keep_ngrams=True, block_size=65536):
+    """Write a quantized copy of the embedding store in store_dir to out_dir
+
+    The IVF index is not copied, build a new one for the quantized store with ann_index.py.
+
+    Keyword arguments:
+    store_dir -- directory of the full embedding store
+    out_dir -- output directory, created if it doesn't exist
+    dtype -- "int8" or "float16"
+    top_n -- only keep the top_n most frequent words (default: keep all words)
+    keep_ngrams -- keep the subword vectors (as float16), needed for unknown words
+    block_size -- number of vectors to convert at a time
+    """
+    if dtype not in DTYPES:
+        raise ValueError('Please specify a dtype: "int8" or "float16"')
+    store = embedding_store.EmbeddingStore(store_dir)
+    count = len(store) if top_n is None else min(top_n, len(store))
+    os.makedirs(out_dir, exist_ok=True)
+
+    log.info("Writing %d %s word vectors...", count, dtype)
+    vectors = np.lib.format.open_memmap(os.path.join(out_dir, "vectors.npy"), mode="w+", dtype=DTYPES[dtype], shape=(count, store.config["dim"]))
+    if dtype == "int8":
+        scales = np.zeros(count, dtype=np.float32)
+    for start in range(0, count, block_size):
+        block = store.rows(start, min(start + block_size, count))
+        if dtype == "int8":
+            maxima = np.abs(block).max(axis=1)
+            maxima[maxima == 0] = 1
+            vectors[start:start + len(block)] = np.round(block / maxima[:, None] * 127)
+            scales[start:start + len(block)] = maxima / 127
+        else:
+            vectors[start:start + len(block)] = block
+    vectors.flush()
+    del vectors
+    if dtype == "int8":
+        np.save(os.path.join(out_dir, "vector_scales.npy"), scales)
+
+    config = dict(store.config, count=count, quantization=dtype)
+    if keep_ngrams and store.ngrams is not None:
+        log.info("Writing float16 subword vectors...")
+        ngrams = np.lib.format.open_memmap(os.path.join(out_dir, "ngrams.npy"), mode="w+", dtype=np.float16, shape=store.ngrams.shape)
+        for start in range(0, len(store.ngrams), block_size):
+            ngrams[start:start + block_size] = store.ngrams[start:start + block_size]
+        ngrams.flush()
+        del ngrams
+    else:
+        config["bucket"] = 0
+
+    if top_n is None:
+        for name in ["words.bin", "word_offsets.npy", "sorted_ids.npy"]:
+            shutil.copyfile(os.path.join(store_dir, name), os.path.join(out_dir, name))
+    else:
+        embedding_store._write_vocabulary(out_dir, [store.word(i) for i in range(0, count)])
+    if store.noun_mask is not None:
+        np.save(os.path.join(out_dir, "noun_mask.npy"), store.noun_mask[:count])
+    with open(os.path.join(out_dir, "config.json"), "w") as outfile:
+        json.dump(config, outfile)
+
+def compare_stores(full, compact, queries=100, topn=10, seed=0):
+    """Print and return how well a compact store reproduces the results of the full store
+
+    Query words are sampled from the words that both stores have.
+
+    Keyword arguments:
+    full, compact -- EmbeddingStore objects
+    queries -- number of query words
+    topn -- number of neighbours to compare
+
+    Returns:
+    a dictionary with
+    neighbour_recall -- overlap of the topn most similar words
+    related_recall -- overlap of the related nouns, if both stores have a noun mask
+    score_error -- mean absolute difference in cosine similarity of the compact neighbours
+    size_ratio -- size of the compact vector files divided by the size of the full ones
+    """
+    rng = random.Random(seed)
+    words = [full.word(rng.randrange(min(len(full), len(compact)))) for i in range(0, queries)]
+    overlap = 0
+    related_overlap = 0
+    related_total = 0
+    errors = []
+    for word in words:
+        expected = full.similar_by_word(word, topn)
+        found = compact.similar_by_word(word, topn)
+        overlap += len(set(w for w, s in expected) & set(w for w, s in found))
+        query = full.vector(full.word_id(word))
+        for w, score in found:
+            errors.append(abs(score - float(np.dot(full.vector(full.word_id(w)), query))))
+        if full.noun_mask is not None and compact.noun_mask is not None:
+            expected_nouns = full.related_nouns(word)
+            related_overlap += len(set(expected_nouns) & set(compact.related_nouns(word)))
+            related_total += len(expected_nouns)
+
+    def size(store):
+        return sum(os.path.getsize(os.path.join(store.store_dir, name)) for name in ["vectors.npy", "ngrams.npy", "vector_scales.npy"] if os.path.exists(os.path.join(store.store_dir, name)))
+
+    report = {
+        "neighbour_recall": overlap / float(queries * topn),
+        "related_recall": related_overlap / float(related_total) if related_total > 0 else None,
+        "score_error": float(np.mean(errors)) if errors else 0.0,
+        "size_ratio": size(compact) / float(size(full)),
+    }
+    for key in report:
+        print(key, report[key])
+    return report
+
+if __name__ == "__main__":
+    # usage: python -m churnalist.quantize int8|float16 [store_dir] [out_dir] [top_n]
+    # or:    python -m churnalist.quantize report [store_dir] [out_dir]
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = sys.argv[1:]
+    store_dir = args[1] if len(args) > 1 else embedding_store.EN_STORE
+    out_dir = args[2] if len(args) > 2 else store_dir + ".int8"
+    if args[0] == "report":
+        compare_stores(embedding_store.EmbeddingStore(store_dir), embedding_store.EmbeddingStore(out_dir))
+    else:
+        quantize(store_dir, out_dir, args[0], int(args[3]) if len(args) > 3 else None)
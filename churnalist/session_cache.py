@@ -0,0 +1,132 @@
+#!/usr/bin/python
+"""Cache for the analysis of input texts
+
+Analysing an input text (tokenizing, parsing, finding context words) is the
+slow part of a demo request. A SessionCache keeps the result per input text,
+keyed by a hash of the text, so a text that is submitted again, or the second
+step of the interactive flow, does not need to be parsed again.
+
+Entries are dicts. The JSON-serializable part of an entry (PERSISTENT_FIELDS,
+e.g. context words and seed words) can also be kept on disk in cache_dir, so
+it survives a restart; the other fields (e.g. prepared headline targets that
+point into spaCy docs) only live in memory. When the estimated size of all
+entries in memory is over max_bytes, the least recently used ones are dropped.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+PERSISTENT_FIELDS = ("contextwords", "seedwords")
+# rough size of an in-memory field that is not persisted, per item
+ITEM_SIZE = 2048
+
+KEY_PATTERN = re.compile("^[0-9a-f]{64}$")
+
+def text_key(text):
+    """Return the cache key of an input text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def entry_size(entry):
+    """Estimate the memory use of a cache entry in bytes"""
+    size = 0
+    for field, value in entry.items():
+        if field in PERSISTENT_FIELDS:
+            size += len(json.dumps(value))
+        elif value is not None:
+            size += ITEM_SIZE * (len(value) if hasattr(value, "__len__") else 1)
+    return size
+
+class SessionCache:
+    def __init__(self, max_bytes=64*1024*1024, cache_dir=None):
+        """Create an empty cache
+
+        Keyword arguments:
+        max_bytes -- estimated memory limit of the entries
+        cache_dir -- directory to keep the persistent fields in, or None for memory only
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict() # key -> (entry, size), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _load(self, key):
+        """Return the persistent fields of key from disk, or None"""
+        if self.cache_dir is None or not KEY_PATTERN.match(key): # keys can come from a form
+            return None
+        try:
+            with open(self._path(key), "r") as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key, entry):
+        if self.cache_dir is None:
+            return
+        tmp = self._path(key) + ".tmp"
+        try:
+            with open(tmp, "w") as outfile:
+                json.dump({field: entry[field] for field in PERSISTENT_FIELDS if field in entry}, outfile)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            log.warning("Could not save session %s: %s", key, e)
+
+    def get(self, key):
+        """Return the entry for key (from memory or disk), or None"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                self._entries.move_to_end(key)
+                return item[0]
+        entry = self._load(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """Add or replace the entry for key, e.g. after adding prepared targets"""
+        self._remember(key, entry)
+        self._save(key, entry)
+
+    def _remember(self, key, entry):
+        size = entry_size(entry)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (entry, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted, (evicted_entry, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get_or_create(self, text, factory):
+        """Return (key, entry) for an input text, calling factory(text) only if it is not cached"""
+        key = text_key(text)
+        entry = self.get(key)
+        if entry is None:
+            entry = factory(text)
+            self.put(key, entry)
+        return key, entry
+
+    def stats(self):
+        """Return the number of entries and their estimated size"""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
@@ -1,20 +1,16 @@
 #!/usr/bin/python
-import random
 import json
-import nltk
-import spacy
-import pattern3.en, pattern3.nl
+import random
+import logging
+import functools
+from churnalist import metrics
+from churnalist import pipelines
+from churnalist import line_index
+from churnalist.paths import data_path
 
-PLAINTEXT_EN = "../data/headlines.txt"
+log = logging.getLogger(__name__)
 
-# source: https://stackoverflow.com/questions/3540288/how-do-i-read-a-random-line-from-one-file-in-python
-# reads a random line from afile
-def random_line(afile):
-    line = next(afile)
-    for num, aline in enumerate(afile, 2):
-      if random.randrange(num): continue
-      line = aline
-    return line
+PLAINTEXT_EN = data_path("headlines.txt")
 
 def get_random_headline(lang="en"):
     """Return a random headline from the dataset
@@ -29,34 +25,30 @@ def get_random_headline(lang="en"):
     if lang == "nl":
         raise ValueError("Plaintext files not available for Dutch")
     elif lang == "en":
-        with open(PLAINTEXT_EN,"r") as infile:
-            return random_line(infile).strip()
+        return line_index.get_index(PLAINTEXT_EN).sample(1)[0].strip()
     else:
         raise ValueError("Please specify a headline language ('en' or 'nl')")
 
-def get_n_random_headlines(lang="en", n=100):
+def get_n_random_headlines(lang="en", n=100, rng=random, ids=None):
     """Return a list of n random headline from the headlines dataset
 
     Keyword arguments:
     lang -- "nl" or "en"
     n -- number of random headlines to return
+    rng -- random number generator (default: the random module)
+    ids -- only sample from these line numbers (default: all lines)
 
     Note that data/ currently only contains English
     plaintext headlines.
+    Headlines are read through a line-offset index (see line_index.py),
+    so this costs n seeks and does not read the whole file.
     """
     if n <= 0:
         raise ValueError("N can't be negative")
-    if n > 5000:
-        raise Warning("N is high. This might clog your memory. Use this carefully.")
-    results = []
     if lang == "nl":
         raise ValueError("Plaintext files not available for Dutch")
     elif lang == "en":
-        with open(PLAINTEXT_EN,"r") as infile:
-            lines = infile.readlines()
-            for i in range(0,n):
-                results.append(random.choice(lines))
-            return results
+        return line_index.get_index(PLAINTEXT_EN).sample(n, rng, ids)
     else:
         raise ValueError("Please specify a headline language ('en' or 'nl')")
 
@@ -74,13 +66,12 @@ def find_subj(sentence, lang):
     sentence -- string, one sentence from the array as results from nltk.sent_tokenize() function
     lang -- language, "nl" or "en"
     """
-    if lang == "nl":
-        nlp = spacy.load('nl_core_news_sm')
-    elif lang == "en":
-        nlp = spacy.load('en_core_web_sm')
-    else:
-        raise ValueError('Please specify your language of choice: "nl" or "en"')
-    doc = nlp(sentence)
+    nlp = pipelines.get_pipeline(lang, pipelines.NO_NER)
+    metrics.count("parse_calls")
+    return find_subj_in_doc(nlp(sentence))
+
+def find_subj_in_doc(doc):
+    """Return the nsubj noun chunk or token of a parsed sentence, or None"""
     # we try it first with noun_chunks from spacy (not available for dutch)
     for chunk in doc.noun_chunks:
         if chunk.root.dep_ == "nsubj":
@@ -112,13 +103,12 @@ def find_obj(sentence, lang):
     sentence -- string, one sentence from the array as results from nltk.sent_tokenize() function
     lang -- language, "nl" or "en"
     """
-    if lang == "nl":
-        nlp = spacy.load('nl_core_news_sm')
-    elif lang == "en":
-        nlp = spacy.load('en_core_web_sm')
-    else:
-        raise ValueError('Please specify your language of choice: "nl" or "en"')
-    doc = nlp(sentence)
+    nlp = pipelines.get_pipeline(lang, pipelines.NO_NER)
+    metrics.count("parse_calls")
+    return find_obj_in_doc(nlp(sentence))
+
+def find_obj_in_doc(doc):
+    """Return the dobj noun chunk or token of a parsed sentence, or None"""
     # let's try to find an object:
     for chunk in doc.noun_chunks:
         if chunk.root.dep_ == "dobj":
@@ -128,36 +118,110 @@ def find_obj(sentence, lang):
             return token
     return None
 
+def get_number(target, lang):
+    """Return "singular" or "plural" for a substitution target, based on its parser tag
+
+    For noun chunks we look at the tag of the root noun.
+    Returns None if the tag says nothing about number.
+
+    Keyword arguments:
+    target -- spaCy Span or Token, as returned by find_obj() and find_subj()
+    lang -- language "nl" or "en"
+    """
+    tag = target.root.tag_ if hasattr(target, "root") else target.tag_
+    if lang == "en":
+        if tag in ["NNS", "NNPS"]:
+            return "plural"
+        if tag in ["NN", "NNP"]:
+            return "singular"
+    elif lang == "nl":
+        if "Plur" in tag:
+            return "plural"
+        if "Sing" in tag:
+            return "singular"
+    return None
+
+# size of the inflection caches, large enough for the seed words of a session
+INFLECTION_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=INFLECTION_CACHE_SIZE)
+def inflect(word, number, lang):
+    """Return word in singular or plural form, memoized
+
+    Keyword arguments:
+    word -- the word to inflect
+    number -- "singular" or "plural"
+    lang -- language "nl" or "en"
+    """
+    if lang == "nl":
+        import pattern3.nl
+        if number == "singular":
+            return pattern3.nl.singularize(word)
+        return pattern3.nl.pluralize(word)
+    elif lang == "en":
+        import pattern3.en
+        if number == "singular":
+            return pattern3.en.singularize(word)
+        return pattern3.en.pluralize(pattern3.en.singularize(word)) # singularize does not change a singular word, but pluralize DOES change a plural word :/
+    raise ValueError('Please specify your language of choice: "nl" or "en"')
+
+@functools.lru_cache(maxsize=INFLECTION_CACHE_SIZE)
+def text_number(text, lang):
+    """Return "singular" or "plural" for a word without parser tags, memoized
+
+    Assumption: a word is singular if singularizing it doesn't change it.
+    """
+    if lang == "nl":
+        import pattern3.nl
+        return "singular" if pattern3.nl.singularize(text) == text else "plural"
+    import pattern3.en
+    return "singular" if pattern3.en.singularize(text) == text else "plural"
+
+def _target_number(token, lang):
+    """Return "singular" or "plural" for a string, spaCy Span/Token or annotation store Target"""
+    number = getattr(token, "number", None) # Targets from the annotation store know their number
+    if number is not None:
+        return number
+    if lang == "nl" and not isinstance(token, str):
+        return "singular" if get_number(token, lang) == "singular" else "plural"
+    # for english, we don't have plural/singular tags
+    return text_number(str(token), lang)
+
 def conjugate(token, new_word, lang):
     """Conjugate new_word so that it matches the form (plural/singular) of token
 
     Tokens in Dutch or English have different parser tags that we can use for conjugation.
     We get the new form from the pattern library for language lang.
+    Inflections are memoized (see inflect()), so seed words that are used
+    over and over again cost a dictionary lookup.
     If we get an error, we return new_word unedited.
 
     Keyword arguments:
-    token -- the source word
+    token -- the source word (string, spaCy Span or Token, or annotation store Target)
     new_word -- this word should get the same form as token
     lang -- language "nl" or "en"
     """
-    if lang == "nl":
-        if "Sing" in token.tag_:
-            return  pattern3.nl.singularize(new_word)
-        return pattern3.nl.pluralize(new_word)
-    elif lang == "en":
-        # for english, we don't have plural/singular tags
-        try:
-            singular_token = pattern3.en.singularize(token)
-            if singular_token == token: # assumption: then token is singular
-                return pattern3.en.singularize(new_word)
-            return pattern3.en.pluralize(pattern3.en.singularize(new_word)) # singularize does not change a singular word, but pluralize DOES change a plural word :/
-        except Exception as exc:
-            print("Could not singularize or pluralize word", token, "or", new_word)
-            print(type(exc), exc)
-            return new_word
-    else:
+    if lang not in ["nl", "en"]:
         raise ValueError('Please specify your language of choice: "nl" or "en"')
-    return new_word
+    try:
+        return inflect(new_word, _target_number(token, lang), lang)
+    except Exception as exc:
+        log.warning("Could not singularize or pluralize word %s or %s: %s %s", token, new_word, type(exc).__name__, exc)
+        metrics.count("conjugation_failures")
+        return new_word
+
+def prewarm_inflections(words, lang):
+    """Fill the inflection cache with the singular and plural forms of words"""
+    for word in words:
+        for number in ["singular", "plural"]:
+            try:
+                inflect(word, number, lang)
+            except Exception as exc:
+                log.warning("Could not inflect word %s: %s %s", word, type(exc).__name__, exc)
+
+def inflection_cache_info():
+    """Return the hit/miss statistics of the inflection caches"""
+    return {"inflect": inflect.cache_info(), "text_number": text_number.cache_info()}
 
 # only works with Nouns
 def substitute(sentence, word, lang, target):
@@ -172,7 +236,7 @@ def substitute(sentence, word, lang, target):
     lang -- language "nl" or "en"
     target -- object or subject 
     """
-    conjugated_word = conjugate(str(target), word, lang)
+    conjugated_word = conjugate(target, word, lang)
     new_sentence = sentence.replace(target.text, conjugated_word, 1)
     return new_sentence
 
@@ -1,5 +1,8 @@
 # Flask
 from flask import Flask
+from flask import Blueprint
+from flask import current_app
+from flask import jsonify
 from flask import request
 from flask import render_template
 from flask import Markup
@@ -7,171 +10,142 @@ from flask import escape
 # for template streaming
 from flask import Response
 
-import random
+import os
+import json
+import time
+import logging
 import nltk
+from churnalist import metrics
+from churnalist import pipelines
 from churnalist import keyword_extraction as ke
 from churnalist import expand_seedwords as kb
+from churnalist import annotation_store
+from churnalist import generation
 from churnalist import topic_substitution as ts
+from churnalist import session_cache
+from churnalist import batching
+
+# log level from the environment, e.g. CHURNALIST_LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.environ.get("CHURNALIST_LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("churnalist.demo")
+
+# counters and timers for /metrics, set CHURNALIST_METRICS=0 to turn them off
+METRICS = metrics.enable() if os.environ.get("CHURNALIST_METRICS", "1") != "0" else None
 
 BLACKLIST = ["rape","sex","war","iraq","iran","kill","gay","murder","troops","terror"]
 
+# precomputed subjects and objects of the headline corpus, made with
+# python -m churnalist.annotation_store (None if it hasn't been made yet)
+HEADLINE_STORE = annotation_store.open_store()
+
+# analysed input texts, see churnalist/session_cache.py
+# set SESSION_DIR to a directory to keep the analyses on disk
+SESSION_DIR = None
+SESSIONS = session_cache.SessionCache(64*1024*1024, SESSION_DIR)
+# number of headline targets that are parsed once per input text (without HEADLINE_STORE)
+PREPARED_TARGETS = 50
+# /stream keeps between this many targets ready in a background thread (low, high)
+PREFETCH_WATERMARKS = (20, 60)
+
+# with CHURNALIST_BATCHING=1, the headlines of concurrent requests are parsed
+# together in shared nlp.pipe() batches (see churnalist/batching.py)
+PARSE_SERVICE = batching.ParseService("en", max_batch=int(os.environ.get("CHURNALIST_BATCH_SIZE", "256")), max_wait=float(os.environ.get("CHURNALIST_BATCH_WAIT", "0.005"))) if os.environ.get("CHURNALIST_BATCHING", "0") == "1" else None
+PARSER = PARSE_SERVICE.parse if PARSE_SERVICE is not None else None
+
+def analyse(inputtext):
+    """Find the context words and seed words of an input text"""
+    log.info("Tokenizing and parsing...")
+    with metrics.stage("parse_input"):
+        sentences = nltk.sent_tokenize(inputtext)
+        parserinfo, noun_chunks, noun_dict = ke.get_noun_chunk_list(sentences,"en")
+    #print(noun_dict)
+    #for k in noun_dict:
+    #  print(k,noun_dict[k])
+
+    useConceptNet = False
+
+    # STEP 2: knowledge base
+    log.info("Building knowledge base...")
+    ftw = kb.LazyFastText("en_gensimfast")
+    notfound = []
+    kb_results = {}
+    if useConceptNet:
+        with metrics.stage("knowledge_base"):
+            words = list(dict.fromkeys(w.lower() for w in noun_dict.keys())) # unique, in order
+            log.info("Searching related words for %d words in ConceptNet...", len(words))
+            kb_results = kb.get_related_words_batch("conceptnet", words, "en", 5, ftw)
+            notfound = [word for word in words if kb_results[word] == []]
+            # look up all words that ConceptNet doesn't know in one go
+            if len(notfound) > 0:
+                log.info("Searching related words for %d words in FastText...", len(notfound))
+                metrics.count("fasttext_fallbacks", len(notfound))
+                kb_results.update(kb.get_related_words_batch("fasttext", notfound, "en", 25, ftw))
+            for k in kb_results:
+                log.debug("%s: %s", k, ", ".join(kb_results[k]))
+
+    # create pool of seed words from nouns_chunks, noun_dict, kb_results
+    # context words
+    log.info("making contextwords...")
+    contextwords = {}
+
+    # add all original keywords from input
+    for n in noun_dict:
+        contextwords[n.lower()] = []
+        contextwords[n.lower()].append(n) # add yourself, withouth lowercase
+        # noun_dict[something] contains spans, not strings! use w.text instead of w
+        for w in noun_dict[n]:
+            if w.text not in contextwords[n.lower()]:
+                contextwords[n.lower()].append(w.text)
+
+    # generation
+    log.info("making seedwords...")
+    seedwords = [w for n in contextwords.keys() for w in contextwords[n]]
+    #print(seedwords)
+    #seedwords = ["London", "UK", "conference", "games", "COG", "computational intelligence", "researchers", "academic", "industry","creativity","technology","science","research","presentations", "scientific talk","poster presentation","demo paper","science demo"]
+    return {"contextwords": contextwords, "seedwords": seedwords}
+
+def make_generator(seedwords, blacklist, session=None, prefetch=False):
+    """Return a HeadlineGenerator, reusing the prepared headline targets of a session
+
+    With prefetch, targets are sampled in a background thread; close the generator when done.
+    """
+    entry = SESSIONS.get(session) if session is not None else None
+    targets = entry.get("targets") if entry is not None else None
+    if entry is not None and targets is None and HEADLINE_STORE is None:
+        # parse a pool of headlines once, the next requests for this input reuse it
+        sampler = generation.HeadlineGenerator(seedwords, blacklist, "en", HEADLINE_STORE, batch_size=10, prefilter=True, parser=PARSER)
+        targets = sampler.sample_targets(PREPARED_TARGETS)
+        entry["targets"] = targets
+        SESSIONS.put(session, entry)
+    low, high = PREFETCH_WATERMARKS
+    generator = generation.HeadlineGenerator(seedwords, blacklist, "en", HEADLINE_STORE, batch_size=10, prefilter=True, targets=targets, parser=PARSER,
+                                             prefetch=prefetch, low_watermark=low, high_watermark=high)
+    return generator
+
 class StaticChurnalist():
     def __init__(self, inputtext):
         self.inputtext = inputtext
-        self.seedwords = []
-        self.headline_stash = []
         self.blacklist = ["rape","sex","war","iraq","iran","kill","gay","murder","troops","terror"]
-        self.contextwords = {}
 
         if inputtext == "":
             raise ValueError("The input text cannot be empty")
 
-        print("Tokenizing and parsing...")
-        sentences = nltk.sent_tokenize(inputtext)
-        parserinfo, noun_chunks, noun_dict = ke.get_noun_chunk_list(sentences,"en")
-        #print(noun_dict)
-        #for k in noun_dict:
-        #  print(k,noun_dict[k])
-
-        useConceptNet = False
-
-        # STEP 2: knowledge base
-        print("Building knowledge base...")
-        ftw = kb.LazyFastText("en_gensimfast")
-        notfound = []
-        kb_results = {}
-        if useConceptNet:
-            for word in [w.lower() for w in noun_dict.keys()]:
-                if word not in kb_results:
-                    print("Searching related words for",word,"in ConceptNet...")
-                    try:
-                        related_words = kb.get_related_words("conceptnet", word, "en", 5, ftw)
-                    except Exception as e:
-                        print(e,type(e))
-                        continue
-                    if len(related_words) == []:
-                        print("Searching related words for",word,"in FastText...")
-                        notfound.append(word)
-                        related_words = kb.get_related_words("fasttext", word, "en", 25, ftw)
-                    kb_results[word] = related_words
-                else:
-                    continue
-            for k in kb_results:
-              print(k)
-              for rel_word in kb_results[k]:
-                print("\t",rel_word)
-
-        # create pool of seed words from nouns_chunks, noun_dict, kb_results
-        # context words
-        print("making contextwords...")
-        contextwords = {}
-
-        # add all original keywords from input
-        for n in noun_dict:
-            contextwords[n.lower()] = []
-            contextwords[n.lower()].append(n) # add yourself, withouth lowercase
-            # noun_dict[something] contains spans, not strings! use w.text instead of w
-            for w in noun_dict[n]:
-                if w.text not in contextwords[n.lower()]:
-                    contextwords[n.lower()].append(w.text)
-
-        self.contextwords = contextwords #save contextwords
-
-        # generation
-        print("making seedwords...")
-        self.seedwords = [w for n in contextwords.keys() for w in contextwords[n]]
-        #print(seedwords)
-        #seedwords = ["London", "UK", "conference", "games", "COG", "computational intelligence", "researchers", "academic", "industry","creativity","technology","science","research","presentations", "scientific talk","poster presentation","demo paper","science demo"]
-
-        print("Getting a set of random headlines from dataset")
-        self.headline_stash = ts.get_n_random_headlines("en",10)
+        self.session, entry = SESSIONS.get_or_create(inputtext, analyse)
+        self.contextwords = entry["contextwords"]
+        self.seedwords = entry["seedwords"]
+        self.generator = make_generator(self.seedwords, self.blacklist, self.session)
 
     def generate(self, n):
-        if n < 0:
-            raise ValueError("n for generate(n) can't be lower than 0")
-        for i in range(0,n): # generate 100 headlines max
-            print("Generating headlines...")
-            # generate 1 Gigaword headlines
-            # choose a new word, from the seed word and all related words
-            new_word = random.choice(self.seedwords)
-            print("Seedword: ",new_word)
-            obj = None
-            print("Finding substitution target...")
-            while type(obj) == type(None): # as long as we have not found a substitution target
-                # get random headline
-                try:
-                    headline = self.headline_stash.pop()
-                except Exception as e:
-                    self.headline_stash = ts.get_n_random_headlines("en",10)
-                    headline = self.headline_stash.pop()
-                obj = ts.find_obj(headline,"en")
-            print(headline.strip())
-            print("Changing the object of the sentence...")
-            new_headline = ts.substitute(headline, new_word, "en", obj) # new_word from noun_dict is a Span, not string!
-            new_new_headline = new_headline
-            subj_change = random.randrange(0,10)
-            if subj_change >= 9:
-                print("Changing the subject of the sentence too...")
-                try:
-                    new_word = random.choice(self.seedwords)
-                    subj = ts.find_subj(new_headline, "en")
-                    new_new_headline = ts.substitute(new_headline, new_word, "en", subj).strip()
-                except Exception as e:
-                    #print(e)
-                    pass
-            print(new_new_headline)
-            badwords = [badword for badword in self.blacklist if badword in new_new_headline.lower()]
-            if len(badwords) > 0:
-                print("Error, blacklist words", str(badwords), "found in", new_new_headline)
-                continue
-            yield new_new_headline
+        return self.generator.generate(n)
 
 class InteractiveChurnalist():
-    def __init__(self, seedwords, blacklist):
+    def __init__(self, seedwords, blacklist, session=None):
         self.seedwords = [s.strip() for s in seedwords if s.strip() != ""]
         self.blacklist = blacklist
-        print("Getting a set of random headlines from dataset")
-        self.headline_stash = ts.get_n_random_headlines("en",10)
+        self.generator = make_generator(self.seedwords, self.blacklist, session)
 
     def generate(self, n):
-        if n < 0:
-            raise ValueError("n for generate(n) can't be lower than 0")
-        for i in range(0,n): # generate 100 headlines max
-            print("Generating headlines...")
-            # generate 1 Gigaword headlines
-            # choose a new word, from the seed word and all related words
-            new_word = random.choice(self.seedwords)
-            print("Seedword: ",new_word)
-            obj = None
-            print("Finding substitution target...")
-            while type(obj) == type(None): # as long as we have not found a substitution target
-                # get random headline
-                try:
-                    headline = self.headline_stash.pop()
-                except Exception as e:
-                    self.headline_stash = ts.get_n_random_headlines("en",10)
-                    headline = self.headline_stash.pop()
-                obj = ts.find_obj(headline,"en")
-            print(headline.strip())
-            print("Changing the object of the sentence...")
-            new_headline = ts.substitute(headline, new_word, "en", obj) # new_word from noun_dict is a Span, not string!
-            new_new_headline = new_headline
-            subj_change = random.randrange(0,10)
-            if subj_change >= 9:
-                print("Changing the subject of the sentence too...")
-                try:
-                    new_word = random.choice(self.seedwords)
-                    subj = ts.find_subj(new_headline, "en")
-                    new_new_headline = ts.substitute(new_headline, new_word, "en", subj).strip()
-                except Exception as e:
-                    #print(e)
-                    pass
-            print(new_new_headline)
-            badwords = [badword for badword in self.blacklist if badword in new_new_headline.lower()]
-            if len(badwords) > 0:
-                print("Error, blacklist words", str(badwords), "found in", new_new_headline)
-                continue
-            yield new_new_headline
+        return self.generator.generate(n)
 
 
 def postprocess_fade(headlinegen): #gets a generator, yields a generator
@@ -190,18 +164,130 @@ def postprocess_ticker(headlinegen): #gets a generator, yields a generator
 # helper function for template streaming
 # source: https://flask.palletsprojects.com/en/1.1.x/patterns/streaming/
 def stream_template(template_name, **context):
-    app.update_template_context(context)
-    t = app.jinja_env.get_template(template_name)
+    current_app.update_template_context(context)
+    t = current_app.jinja_env.get_template(template_name)
     rv = t.stream(context)
     rv.enable_buffering(5)
     return rv
 
-app = Flask(__name__)
-@app.route('/', methods=['GET', 'POST'])
+# warm-up status of this process, see warm_up() and /health
+# warmup: "pending", "done", "failed" or "skipped" (CHURNALIST_WARMUP=0, models load on first use)
+STATUS = {"ready": False, "warmup": "pending", "warmup_seconds": None, "error": None}
+
+def warm_up():
+    """Load and exercise everything a request needs, so the first request is as fast as the rest
+
+    Loads the NLTK data and the spaCy pipeline, parses a dummy text and
+    generates a dummy headline (which also opens the line index or the
+    annotation store and builds the blacklist pools).
+    """
+    if STATUS["warmup"] == "done": # already warm, e.g. create_app() was called twice
+        return
+    start = time.time()
+    try:
+        log.info("Warming up...")
+        nltk.corpus.stopwords.words('english')
+        nltk.sent_tokenize("Churnalist is warming up. This is the second sentence.")
+        pipelines.preload(["en"], pipelines.NO_NER)
+        ke.get_noun_chunk_list(["The parser reads a short sentence about a headline generator."], "en")
+        list(make_generator(["warm-up"], BLACKLIST).generate(1))
+        STATUS["ready"] = True
+        STATUS["warmup"] = "done"
+        STATUS["error"] = None
+    except Exception as e: # keep serving, /health reports the problem
+        log.exception("Warm-up failed: %s", e)
+        STATUS["warmup"] = "failed"
+        STATUS["error"] = str(e)
+    STATUS["warmup_seconds"] = round(time.time() - start, 3)
+    log.info("Warm-up done in %s seconds", STATUS["warmup_seconds"])
+
+pages = Blueprint('churnalist', __name__)
+
+@pages.route('/health')
+def health():
+    caches = {name: info._asdict() for name, info in ts.inflection_cache_info().items()}
+    status = dict(STATUS, pipelines=[{"lang": lang, "disabled": list(disable)} for lang, disable in pipelines.loaded_pipelines()], store=HEADLINE_STORE is not None, sessions=SESSIONS.stats(), inflection_caches=caches)
+    return jsonify(status), 200 if STATUS["ready"] else 503
+
+@pages.route('/metrics')
+def metrics_page():
+    """Counters and histograms in the Prometheus text format, see churnalist/metrics.py"""
+    if METRICS is None:
+        return Response("# metrics are turned off (CHURNALIST_METRICS=0)\n", status=404, mimetype="text/plain")
+    return Response(METRICS.render() + inflection_cache_metrics(), mimetype="text/plain; version=0.0.4")
+
+def inflection_cache_metrics():
+    """Hits, misses and size of the inflection caches in the Prometheus text format"""
+    lines = []
+    for field, kind in [("hits", "counter"), ("misses", "counter"), ("currsize", "gauge")]:
+        name = metrics.PREFIX + "inflection_cache_" + field + ("_total" if kind == "counter" else "")
+        lines.append("# TYPE %s %s" % (name, kind))
+        for cache, info in sorted(ts.inflection_cache_info().items()):
+            lines.append('%s{cache="%s"} %d' % (name, cache, getattr(info, field)))
+    return "\n".join(lines) + "\n"
+
+@pages.route('/', methods=['GET', 'POST'])
 def startpage():
     return render_template('startpage.html', title="Generator input")
 
-@app.route('/generate', methods=['POST'])
+def headline_stream(generator, limit=None, fmt="sse"):
+    """Yield headlines from generator as server-sent events or JSON lines, until limit (or forever)
+
+    Headlines are only generated when the server asks for the next chunk, so a
+    slow client slows down generation instead of filling a buffer. When the
+    client disconnects, the server closes this generator and generation stops.
+    """
+    count = 0
+    try:
+        while limit is None or count < limit:
+            headline = generator.next_headline()
+            count += 1
+            if fmt == "jsonl":
+                yield json.dumps({"id": count, "headline": headline}) + "\n"
+            else:
+                yield "id: %d\ndata: %s\n\n" % (count, json.dumps({"headline": headline}))
+    except ValueError as e: # e.g. every headline is blacklisted
+        if fmt == "jsonl":
+            yield json.dumps({"error": str(e)}) + "\n"
+        else:
+            yield "event: error\ndata: %s\n\n" % json.dumps({"error": str(e)})
+    finally:
+        generator.close()
+        log.info("Stream stopped after %d headlines", count)
+
+@pages.route('/stream', methods=['GET', 'POST'])
+def stream():
+    """Open-ended feed of headlines, for tickers
+
+    Parameters (query string or form):
+    seedword -- a seed word, can be repeated
+    session -- session key from the seed word page, to use its seed words and prepared targets
+    limit -- stop after this many headlines (default: never)
+    format -- "sse" for server-sent events (default) or "jsonl" for JSON lines
+    """
+    values = request.values
+    seedwords = [w.strip() for w in values.getlist('seedword') if w.strip() != ""]
+    session = values.get('session')
+    if not seedwords and session is not None:
+        entry = SESSIONS.get(session)
+        if entry is not None:
+            seedwords = entry["seedwords"]
+    if not seedwords:
+        return jsonify({"error": "Please give at least one seedword or a known session"}), 400
+    limit = values.get('limit', type=int)
+    fmt = values.get('format', 'sse')
+    if fmt not in ("sse", "jsonl"):
+        return jsonify({"error": 'format should be "sse" or "jsonl"'}), 400
+    try:
+        generator = make_generator(seedwords, BLACKLIST, session, prefetch=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    mimetype = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    # no caching or proxy buffering, every headline should go out right away
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(headline_stream(generator, limit, fmt), mimetype=mimetype, headers=headers)
+
+@pages.route('/generate', methods=['POST'])
 def process_input():
     if request.method != 'POST':
         return ""
@@ -220,14 +306,37 @@ def fancy_ticker(inputtext):
 
 def interactive_step1(inputtext):
     churn = StaticChurnalist(inputtext)
-    return render_template('seedwords.html', title="Seed word picker", contextwords = churn.contextwords)
+    return render_template('seedwords.html', title="Seed word picker", contextwords = churn.contextwords, session = churn.session)
 
-@app.route('/generate_interactive', methods=['POST'])
+@pages.route('/generate_interactive', methods=['POST'])
 def interactive_step2():
     if request.method != 'POST':
         return ""
     else:
         approved_list = request.form.getlist('human_approved')
         manual_list = [word.strip() for word in request.form['manual_seedwords'].split("\n")]
-        churn = InteractiveChurnalist(approved_list + manual_list, BLACKLIST)
+        churn = InteractiveChurnalist(approved_list + manual_list, BLACKLIST, request.form.get('session'))
         return Response(stream_template('fancyticker.html', big_headlines=postprocess_ticker(churn.generate(5)), ticker_headlines=postprocess_ticker(churn.generate(5)), title="Churnalist: fake news"))
+
+def create_app(warm=None):
+    """Create the Flask app, after loading and warming up the models (unless warm is False)
+
+    "flask run" finds this factory by itself. Pre-forking servers can load the
+    app once and fork the workers afterwards, so all workers share the loaded
+    models (copy-on-write), e.g.:
+    gunicorn --preload --workers 4 "demo.churnalist:create_app()"   # from the repository root
+
+    Keyword arguments:
+    warm -- warm up first (default: None, unless the environment sets CHURNALIST_WARMUP=0)
+    """
+    if warm is None:
+        warm = os.environ.get("CHURNALIST_WARMUP", "1") != "0"
+    if warm:
+        warm_up()
+    elif STATUS["warmup"] == "pending":
+        log.info("Skipping the warm-up, models are loaded by the first requests")
+        STATUS["ready"] = True
+        STATUS["warmup"] = "skipped"
+    app = Flask(__name__)
+    app.register_blueprint(pages)
+    return app
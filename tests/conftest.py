@@ -0,0 +1,20 @@
+import os
+import pytest
+from churnalist import benchmark
+from churnalist import annotation_store
+
+@pytest.fixture
+def make_store(tmpdir):
+    """Return a function that writes a synthetic corpus of n headlines and its annotation store
+
+    The function returns (corpus, store_dir, targets), in tmpdir or in directory if given.
+    """
+    def make(n, shard_size=100000, directory=None):
+        directory = str(directory if directory is not None else tmpdir)
+        corpus = os.path.join(directory, "headlines.txt")
+        store_dir = os.path.join(directory, "headlines.annotations")
+        benchmark.write_corpus(corpus, n)
+        targets = [(s, o) for h, s, o in benchmark.synthetic_headlines(n)]
+        annotation_store.write_store(store_dir, corpus, targets, shard_size=shard_size)
+        return corpus, store_dir, targets
+    return make
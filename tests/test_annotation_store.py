@@ -0,0 +1,53 @@
+import os
+import time
+import pytest
+from churnalist import benchmark
+from churnalist import annotation_store
+
+def test_round_trip(make_store):
+    corpus, store_dir, targets = make_store(250, 100)
+    store = annotation_store.AnnotationStore(store_dir)
+    assert len(store) == 250
+    assert sorted(name for name in os.listdir(store_dir) if name.startswith("shard-")) == ["shard-000000.bin", "shard-000001.bin", "shard-000002.bin"]
+    for i, (headline, subj, obj) in enumerate(benchmark.synthetic_headlines(250)):
+        stored_headline, stored_obj, stored_subj = store.get(i)
+        assert stored_headline.rstrip("\n") == headline
+        assert store.headline(i) == stored_headline
+        for target, stored in [(subj, stored_subj), (obj, stored_obj)]:
+            start, end, tag, number = target
+            assert (stored.text, stored.tag_, stored.number) == (headline[start:end], tag, number)
+
+def test_target_ids(make_store):
+    corpus, store_dir, targets = make_store(250, 100)
+    store = annotation_store.AnnotationStore(store_dir)
+    assert list(store.target_ids()) == list(range(0, 250))
+    plural = [i for i, (s, o) in enumerate(targets) if o[3] == "plural"]
+    assert list(store.target_ids(number="plural")) == plural
+    short = [i for i, (s, o) in enumerate(targets) if o[1] - o[0] <= 4]
+    assert list(store.target_ids(max_length=4)) == short
+
+def test_changed_corpus(make_store):
+    corpus, store_dir, targets = make_store(10, 100)
+    assert annotation_store.open_store(store_dir) is not None
+    time.sleep(0.01)
+    with open(corpus, "a") as outfile:
+        outfile.write("One more headline\n")
+    assert annotation_store.open_store(store_dir) is None
+
+def test_move_store_with_corpus(make_store, tmpdir):
+    make_store(10, 100, tmpdir.mkdir("old"))
+    os.rename(str(tmpdir.join("old")), str(tmpdir.join("new")))
+    store = annotation_store.open_store(str(tmpdir.join("new", "headlines.annotations")))
+    assert store is not None and len(store) == 10
+    assert store.get(0)[0].rstrip("\n") == next(benchmark.synthetic_headlines(1))[0]
+
+def test_missing_corpus(make_store):
+    corpus, store_dir, targets = make_store(10, 100)
+    os.remove(corpus)
+    assert annotation_store.open_store(store_dir) is None
+
+def test_resume_with_same_corpus(make_store):
+    corpus, store_dir, targets = make_store(10, 100)
+    annotation_store._write_manifest(store_dir, corpus, "en", 100)
+    with pytest.raises(ValueError):
+        annotation_store._write_manifest(store_dir, corpus, "en", 50)
@@ -0,0 +1,69 @@
+import threading
+import pytest
+from churnalist import batching
+from churnalist import pipelines
+
+STUB = ("stub",) # disabled components of the stub pipeline, so it has its own registry key
+
+class StubPipeline:
+    """Stands in for a spaCy pipeline: a "doc" is the upper-cased sentence"""
+    def __init__(self):
+        self.calls = []
+
+    def pipe(self, sentences, batch_size=None):
+        sentences = list(sentences)
+        self.calls.append(sentences)
+        return [sentence.upper() for sentence in sentences]
+
+@pytest.fixture
+def nlp(monkeypatch):
+    nlp = StubPipeline()
+    monkeypatch.setitem(pipelines._pipelines, ("en", STUB), nlp)
+    return nlp
+
+def test_concurrent_requests_share_one_pipe_call(nlp):
+    service = batching.ParseService("en", STUB, max_batch=100, max_wait=0.5)
+    clients = 10
+    barrier = threading.Barrier(clients)
+    results = [None] * clients
+    def client(i):
+        barrier.wait()
+        results[i] = service.parse(["sentence %d.%d" % (i, j) for j in range(0, 3)])
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(0, clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    service.close()
+    assert len(nlp.calls) == 1 and len(nlp.calls[0]) == clients * 3
+    assert results == [["SENTENCE %d.%d" % (i, j) for j in range(0, 3)] for i in range(0, clients)]
+
+def test_max_batch(nlp):
+    service = batching.ParseService("en", STUB, max_batch=4, max_wait=0.5)
+    assert service.parse(["s%d" % i for i in range(0, 10)]) == ["S%d" % i for i in range(0, 10)]
+    service.close()
+    assert [len(call) for call in nlp.calls] == [4, 4, 2]
+
+def test_failed_load_fails_the_queued_requests(nlp, monkeypatch):
+    loads = []
+    def get_pipeline(lang, disable=()):
+        loads.append(lang)
+        if len(loads) == 1:
+            raise OSError("no model")
+        return nlp
+    monkeypatch.setattr(pipelines, "get_pipeline", get_pipeline)
+    service = batching.ParseService("en", STUB)
+    futures = service.submit(["a", "b", "c"])
+    for future in futures:
+        with pytest.raises(OSError):
+            future.result(timeout=5)
+    # the next request starts a new worker, which loads the pipeline again
+    assert service.parse(["d"], timeout=5) == ["D"]
+    assert len(loads) == 2
+    service.close()
+
+def test_close_parses_waiting_requests(nlp):
+    service = batching.ParseService("en", STUB, max_wait=0.1)
+    futures = service.submit(["x", "y"])
+    service.close()
+    assert [future.result(timeout=0) for future in futures] == ["X", "Y"]
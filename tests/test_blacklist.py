@@ -0,0 +1,34 @@
+import random
+from churnalist import blacklist as bl
+from churnalist import generation
+
+def old_matches(words, text):
+    """The substring check that Blacklist replaces"""
+    return any(word in text.lower() for word in words)
+
+def test_matches_like_substring_check():
+    words = generation.BLACKLIST + ["warden", "wa", "kill bill", "c++", "a.b"]
+    blacklist = bl.Blacklist(words)
+    rng = random.Random(0)
+    alphabet = "abcdeiklmnorstw +.KWAR"
+    texts = ["".join(rng.choice(alphabet) for i in range(rng.randint(0, 30))) for j in range(5000)]
+    texts += ["Award for the warden", "Skill", "GAY PRIDE", "a b", "axb", "c++ compilers", "nothing here"]
+    for text in texts:
+        assert blacklist.matches(text) == old_matches(words, text), text
+
+def test_whole_words():
+    blacklist = bl.Blacklist(["war"], whole_words=True)
+    assert blacklist.matches("War is over")
+    assert not blacklist.matches("Award for the best film")
+    assert bl.Blacklist(["war"]).matches("Award for the best film")
+
+def test_empty_blacklist():
+    blacklist = bl.Blacklist(["", "  "])
+    assert len(blacklist) == 0
+    assert not blacklist.matches("anything")
+    assert blacklist.find("anything") == []
+
+def test_prefilter():
+    texts = ["Troops leave", "Dragons return", "Terror in the castle", "Wizards win"]
+    ids = bl.prefilter("test_prefilter", len(texts), texts.__getitem__, bl.Blacklist(generation.BLACKLIST))
+    assert list(ids) == [1, 3]
@@ -0,0 +1,83 @@
+import json
+import time
+import types
+import threading
+import http.server
+import pytest
+from churnalist import conceptnet
+
+pytest.importorskip("requests")
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """ConceptNet stand-in: /related/c/<lang>/<word>, "slow" times out and "broken" fails"""
+    requests = []
+
+    def do_GET(self):
+        word = self.path.split("?")[0].split("/")[-1]
+        StubHandler.requests.append(word)
+        if word == "slow":
+            time.sleep(1)
+        if word == "broken":
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({"related": [{"@id": "/c/en/%s_friend" % word, "weight": 0.5}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    StubHandler.requests = []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the time module of conceptnet.py by one whose time() can be moved forward"""
+    now = [time.time()]
+    monkeypatch.setattr(conceptnet, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+def test_second_call_hits_the_cache(server, tmpdir):
+    client = conceptnet.ConceptNetClient(server, str(tmpdir.join("cache.sqlite")))
+    first = client.related("dragon", "en")
+    assert first["related"][0]["@id"] == "/c/en/dragon_friend"
+    assert client.related("dragon", "en") == first
+    assert StubHandler.requests == ["dragon"]
+    # the cache is on disk, a new client doesn't ask again either
+    assert conceptnet.ConceptNetClient(server, str(tmpdir.join("cache.sqlite"))).related("dragon", "en") == first
+    assert StubHandler.requests == ["dragon"]
+
+def test_expired_answers_are_fetched_again(server, clock):
+    client = conceptnet.ConceptNetClient(server, None, ttl=60)
+    client.related("castle", "en")
+    clock[0] += 30
+    client.related("castle", "en")
+    assert StubHandler.requests == ["castle"]
+    clock[0] += 31
+    client.related("castle", "en")
+    assert StubHandler.requests == ["castle", "castle"]
+
+def test_failures_are_not_cached(server):
+    client = conceptnet.ConceptNetClient(server, None, timeout=0.2)
+    assert client.related("broken", "en") is None
+    assert client.related("broken", "en") is None
+    assert client.related("slow", "en") is None
+    assert StubHandler.requests.count("broken") == 2
+    assert client._cached("slow", "en") is None
+
+def test_related_many(server):
+    client = conceptnet.ConceptNetClient(server, None, max_workers=4)
+    results = client.related_many(["a", "b", "broken", "a"], "en")
+    assert sorted(results) == ["a", "b", "broken"]
+    assert results["broken"] is None and results["b"]["related"][0]["@id"] == "/c/en/b_friend"
@@ -0,0 +1,42 @@
+import os
+import numpy as np
+import pytest
+from churnalist import benchmark
+from churnalist import embedding_store
+
+def test_hash_is_fnv1a():
+    # standard 32-bit FNV-1a test vectors, for ASCII fastText's hash is the same
+    assert embedding_store._ft_hash(b"") == 2166136261
+    assert embedding_store._ft_hash(b"a") == 0xe40c292c
+    assert embedding_store._ft_hash(b"foobar") == 0xbf9cf968
+
+def test_hash_reads_signed_chars():
+    # fastText casts every byte to int8_t before the xor, so bytes >= 128 are sign-extended
+    expected = ((2166136261 ^ 0xFFFFFFC3) * 16777619) & 0xFFFFFFFF
+    assert embedding_store._ft_hash(b"\xc3") == expected
+
+def test_subwords():
+    bucket = 2000000
+    h = lambda ngram: embedding_store._ft_hash(ngram.encode("utf-8")) % bucket
+    assert embedding_store.subword_ids("ab", 3, 6, bucket) == [h("<ab"), h("<ab>"), h("ab>")]
+    # n counts characters, not bytes; "<" and ">" alone are not subwords
+    assert embedding_store.subword_ids("é", 1, 2, bucket) == [h("<é"), h("é"), h("é>")]
+    assert embedding_store.subword_ids("ab", 5, 6, bucket) == []
+
+def test_subwords_match_fasttext(tmpdir):
+    fasttext = pytest.importorskip("fasttext")
+    corpus = os.path.join(str(tmpdir), "corpus.txt")
+    benchmark.write_corpus(corpus, 200)
+    model = fasttext.train_unsupervised(corpus, model="skipgram", dim=10, epoch=1, minCount=1, minn=2, maxn=5, bucket=5000)
+    for word in ["dragon", "wizardsé", "zzz", "naïve"]:
+        subwords, ids = model.get_subwords(word)
+        expected = sorted(int(i) - len(model.words) for i in ids if i >= len(model.words))
+        assert sorted(embedding_store.subword_ids(word, 2, 5, 5000)) == expected
+
+def test_out_of_vocabulary_vector(tmpdir):
+    store_dir = os.path.join(str(tmpdir), "embedding.store")
+    words = benchmark.write_embedding(store_dir, count=100, dim=8)
+    store = embedding_store.EmbeddingStore(store_dir)
+    assert words[5] in store
+    ids = embedding_store.subword_ids("unknownword", 3, 6, len(store.ngrams))
+    np.testing.assert_allclose(store.get_word_vector("unknownword"), np.asarray(store.ngrams[ids]).mean(axis=0), rtol=1e-6)
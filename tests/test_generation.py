@@ -0,0 +1,21 @@
+from churnalist import generation
+
+SEEDWORDS = ["dragon", "wizards", "castle"]
+
+def test_parallel_output_does_not_depend_on_processes(make_store):
+    corpus, store_dir, targets = make_store(500)
+    runs = [generation.generate_parallel(SEEDWORDS, 50, seed=7, processes=processes, chunk_size=8, store_dir=store_dir, prefilter=True)
+            for processes in [1, 2, 3]]
+    assert len(runs[0]) == 50
+    assert runs[0] == runs[1] == runs[2]
+    assert not any(generation.HeadlineGenerator(SEEDWORDS).is_banned(headline) for headline in runs[0])
+
+def test_parallel_seeds(make_store):
+    corpus, store_dir, targets = make_store(500)
+    first = generation.generate_parallel(SEEDWORDS, 20, seed=1, processes=2, chunk_size=8, store_dir=store_dir)
+    assert first == generation.generate_parallel(SEEDWORDS, 20, seed=1, processes=2, chunk_size=8, store_dir=store_dir)
+    assert first != generation.generate_parallel(SEEDWORDS, 20, seed=2, processes=2, chunk_size=8, store_dir=store_dir)
+
+def test_chunk_seed():
+    assert generation.chunk_seed(1, 0) == generation.chunk_seed(1, 0)
+    assert len(set(generation.chunk_seed(1, chunk_no) for chunk_no in range(0, 100))) == 100
@@ -0,0 +1,15 @@
+import os
+from churnalist import import_budget
+
+# import times vary a lot between machines, the strict numbers are for python -m churnalist.import_budget
+TIME_FACTOR = 10
+
+def test_import_budget():
+    """Importing a churnalist module loads no heavy library and stays within its memory budget"""
+    assert import_budget.check(time_factor=TIME_FACTOR) == []
+
+def test_budgets_cover_all_modules():
+    """New modules get a budget too (the tools themselves are exempt)"""
+    package = os.path.join(import_budget.ROOT, "churnalist")
+    modules = set("churnalist." + name[:-3] for name in os.listdir(package) if name.endswith(".py") and name != "__init__.py")
+    assert modules - set(import_budget.BUDGETS) <= {"churnalist.import_budget", "churnalist.benchmark"}
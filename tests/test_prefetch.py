@@ -0,0 +1,72 @@
+import time
+import itertools
+import pytest
+from churnalist import prefetch
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+class Sampler:
+    """sample(k) returns the next k integers and records k and the queue length"""
+    def __init__(self):
+        self.counter = itertools.count()
+        self.calls = []
+        self.prefetcher = None
+
+    def __call__(self, k):
+        self.calls.append((k, len(self.prefetcher)))
+        return [next(self.counter) for i in range(0, k)]
+
+def make_prefetcher(batch_size=4, low=5, high=20):
+    sampler = Sampler()
+    sampler.prefetcher = prefetch.Prefetcher(sampler, batch_size, low, high)
+    return sampler, sampler.prefetcher
+
+def test_stays_within_watermarks():
+    sampler, prefetcher = make_prefetcher()
+    assert prefetcher.get() == 0
+    wait_until(lambda: len(sampler.calls) == 5) # filled up to the high watermark once
+    assert len(prefetcher) == 19
+    # never asks for more than fits under the high watermark
+    assert all(k <= 4 and ready + k <= 20 for k, ready in sampler.calls)
+    assert [prefetcher.get() for i in range(0, 13)] == list(range(1, 14))
+    time.sleep(0.05)
+    assert len(sampler.calls) == 5 # 6 left, above the low watermark
+    assert prefetcher.get() == 14 # 5 left, refill
+    wait_until(lambda: len(prefetcher) == 20)
+    assert all(k <= 4 and ready + k <= 20 for k, ready in sampler.calls)
+    assert [prefetcher.get() for i in range(0, 20)] == list(range(15, 35)) # in order
+    prefetcher.close()
+
+def test_sampling_errors_are_raised_from_get():
+    def sample(k):
+        raise RuntimeError("corpus is gone")
+    prefetcher = prefetch.Prefetcher(sample, 4, 1, 4)
+    with pytest.raises(RuntimeError):
+        prefetcher.get()
+    prefetcher.close()
+
+def test_no_targets(monkeypatch):
+    monkeypatch.setattr(prefetch, "MAX_EMPTY_BATCHES", 3)
+    prefetcher = prefetch.Prefetcher(lambda k: [], 4, 1, 4)
+    with pytest.raises(ValueError):
+        prefetcher.get()
+
+def test_close_stops_the_thread():
+    sampler, prefetcher = make_prefetcher()
+    prefetcher.get()
+    thread = prefetcher._thread
+    prefetcher.close()
+    assert not thread.is_alive()
+    ready = len(prefetcher)
+    assert [prefetcher.get() for i in range(0, ready)] # what was ready can still be taken
+    with pytest.raises(ValueError):
+        prefetcher.get()
+
+def test_invalid_watermarks():
+    with pytest.raises(ValueError):
+        prefetch.Prefetcher(lambda k: [], 4, 10, 10)